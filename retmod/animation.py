@@ -0,0 +1,137 @@
+import numpy as np
+
+class _Frame(object):
+    """
+    A frame as indices into the sequence's unique rows of cells and attribute rows. The
+    index arrays are read-only so copies of a frame can share them until one is stored over.
+    """
+    def __init__(self, cellRows, attrRows):
+        self.cellRows = cellRows
+        self.attrRows = attrRows
+
+class _UniqueStore(object):
+    """
+    Append-only store of unique fixed-size byte blocks, viewed as unsigned integers
+    """
+    def __init__(self, dtype, width):
+        self._dtype = dtype
+        self._index = dict()
+        self._data = np.zeros((64, width), dtype=dtype)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        return self._data[:self._count].nbytes
+
+    def add(self, blocks):
+        """
+        Returns the ids of the (n, width) blocks, adding any not already stored
+        """
+        blocks = np.ascontiguousarray(blocks, dtype=self._dtype)
+        keys = [block.tobytes() for block in blocks]
+        ids = np.empty(len(keys), dtype=np.uint32)
+        for i, key in enumerate(keys):
+            id = self._index.get(key)
+            if id is None:
+                id = self._append(blocks[i])
+                self._index[key] = id
+            ids[i] = id
+        return ids
+
+    def _append(self, block):
+        if self._count == len(self._data):
+            self._data = np.concatenate([self._data, np.zeros_like(self._data)])
+        self._data[self._count] = block
+        self._count += 1
+        return self._count - 1
+
+    def get(self, ids):
+        return self._data[ids]
+
+class FrameSequence(object):
+    """
+    A sequence of ZX Spectrum screens stored as shared 8x8 bitmap cells and attribute rows.
+    Identical cells, rows of cell indices and attribute rows are only stored once however
+    many frames use them, so a frame itself is just 48 row indices. Inserting a copy of a
+    frame shares its indices until either is stored over.
+    """
+    ATTR_WIDTH = 32
+    ATTR_HEIGHT = 24
+
+    def __init__(self):
+        # A cell is its 8 bitmap bytes viewed as one 64 bit value
+        self._cells = _UniqueStore(np.uint64, 1)
+        self._cellRows = _UniqueStore(np.uint32, self.ATTR_WIDTH)
+        self._attrRows = _UniqueStore(np.uint8, self.ATTR_WIDTH)
+        self._frames = []
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def uniqueCells(self):
+        return len(self._cells)
+
+    @property
+    def uniqueAttrRows(self):
+        return len(self._attrRows)
+
+    @property
+    def nbytes(self):
+        frames = {id(frame.cellRows): frame.cellRows.nbytes + frame.attrRows.nbytes for frame in self._frames}
+        return self._cells.nbytes + self._cellRows.nbytes + self._attrRows.nbytes + sum(frames.values())
+
+    def key(self, index):
+        """
+        Returns a key that is equal for frames with identical screens, for caching renders
+        """
+        frame = self._frames[index]
+        return frame.cellRows.tobytes() + frame.attrRows.tobytes()
+
+    def _encode(self, buffer):
+        cells = buffer.bitmap.reshape(self.ATTR_HEIGHT, 8, self.ATTR_WIDTH).transpose(0, 2, 1)
+        cells = np.ascontiguousarray(cells).view(np.uint64).reshape(-1, 1)
+        cellIds = self._cells.add(cells).reshape(self.ATTR_HEIGHT, self.ATTR_WIDTH)
+        cellRowIds = self._cellRows.add(cellIds)
+        attrRowIds = self._attrRows.add(buffer.attributes)
+        cellRowIds.flags.writeable = False
+        attrRowIds.flags.writeable = False
+        return cellRowIds, attrRowIds
+
+    def insertFrame(self, index, buffer=None, copyOf=None):
+        """
+        Inserts a frame holding the buffer's screen, or sharing the frame at copyOf
+        """
+        if buffer is not None:
+            frame = _Frame(*self._encode(buffer))
+        else:
+            source = self._frames[copyOf]
+            frame = _Frame(source.cellRows, source.attrRows)
+        self._frames.insert(index, frame)
+
+    def removeFrame(self, index):
+        del self._frames[index]
+
+    def storeFrame(self, index, buffer):
+        """
+        Replaces the frame at index with the buffer's screen
+        """
+        self._frames[index] = _Frame(*self._encode(buffer))
+
+    def bitmap(self, index):
+        """
+        Returns the frame's packed bitmap as a linear (192, 32) array
+        """
+        cellIds = self._cellRows.get(self._frames[index].cellRows)
+        cells = self._cells.get(cellIds.ravel()).view(np.uint8)
+        cells = cells.reshape(self.ATTR_HEIGHT, self.ATTR_WIDTH, 8).transpose(0, 2, 1)
+        return cells.reshape(self.ATTR_HEIGHT * 8, self.ATTR_WIDTH)
+
+    def attributes(self, index):
+        return self._attrRows.get(self._frames[index].attrRows)
+
+    def loadFrame(self, index, buffer):
+        buffer.setContents(self.bitmap(index), self.attributes(index))
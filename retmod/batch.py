@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+Headless batch rendering of projects and .SCR files to PNG, and conversion of images
+to the screens of the supported machines.
+
+    python -m retmod.batch [-o OUTPUT_DIR] [-j JOBS] [-m MACHINE] [-n] [-s SCALE] FILE...
+"""
+
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+from retmod.zxbuffer import ZXSpectrumBuffer
+from retmod.machines import MACHINES
+from retmod.project import loadProject
+
+PROJECT_EXTENSIONS = (".rdp", ".json")
+
+def loadBuffer(filename, machine="zx"):
+    """
+    Returns a buffer loaded from a .SCR file or a project file, or converted from any
+    other image to the screen of the named machine
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".scr":
+        buffer = ZXSpectrumBuffer()
+        buffer.loadSCR(filename)
+    elif extension in PROJECT_EXTENSIONS:
+        buffer = ZXSpectrumBuffer()
+        loadProject(filename, buffer)
+    else:
+        buffer = MACHINES[machine]()
+        with Image.open(filename) as image:
+            image = image.convert("RGB").resize(buffer.size, Image.LANCZOS)
+        buffer.importImage(np.asarray(image))
+    return buffer
+
+def _machineName(filename, machine):
+    """
+    Returns the name of the machine a file is rendered for
+    """
+    return "zx" if os.path.splitext(filename)[1].lower() in (".scr",) + PROJECT_EXTENSIONS else machine
+
+def outputBases(filenames, outputDir=None, machine="zx", native=False):
+    """
+    Returns the output filename, less its extension, of each input. Under outputDir the
+    inputs keep their directories relative to the directory they have in common. Inputs
+    that would still share an output, such as x.scr and x.rdp, have their extension added,
+    and outputs that would overwrite an input, such as photo.png, the machine's name.
+    """
+    directories = [os.path.dirname(filename) for filename in filenames]
+    if outputDir and filenames:
+        directories = [os.path.dirname(os.path.abspath(filename)) for filename in filenames]
+        common = os.path.commonpath(directories)
+        directories = [os.path.normpath(os.path.join(outputDir, os.path.relpath(directory, common)))
+                       for directory in directories]
+    bases = [os.path.join(directory, os.path.splitext(os.path.basename(filename))[0])
+             for directory, filename in zip(directories, filenames)]
+
+    counts = Counter(os.path.normcase(base) for base in bases)
+    bases = [base + "_" + os.path.splitext(filename)[1][1:] if counts[os.path.normcase(base)] > 1 else base
+             for base, filename in zip(bases, filenames)]
+
+    inputs = set(os.path.normcase(os.path.abspath(filename)) for filename in filenames)
+
+    def overwrites(base, filename):
+        extensions = [".png"]
+        if native:
+            extensions.append(MACHINES[_machineName(filename, machine)].NATIVE_EXTENSION)
+        return any(os.path.normcase(os.path.abspath(base + extension)) in inputs for extension in extensions)
+
+    for index, (base, filename) in enumerate(zip(bases, filenames)):
+        if overwrites(base, filename):
+            base += "_" + _machineName(filename, machine)
+            if overwrites(base, filename):
+                raise ValueError("Output for {} would overwrite an input file".format(filename))
+            bases[index] = base
+    return bases
+
+def renderFile(filename, outputDir=None, machine="zx", native=False, scale=1, outputBase=None):
+    """
+    Renders one file to a palettised PNG next to it, or in outputDir, and returns the PNG
+    filename. With native set the machine's own screen file is written alongside.
+    outputBase overrides the output filename, less its extension.
+    """
+    base = outputBase or outputBases([filename], outputDir, machine, native)[0]
+    if os.path.dirname(base):
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+    buffer = loadBuffer(filename, machine)
+    buffer.saveBuffer(base + ".png", scale=scale)
+    if native:
+        buffer.saveNative(base + buffer.NATIVE_EXTENSION)
+    return base + ".png"
+
+def _renderJob(filename, outputBase, machine, native, scale):
+    # Errors are returned rather than raised so one bad file does not stop the batch
+    try:
+        return filename, renderFile(filename, None, machine, native, scale, outputBase), None
+    except Exception as e:
+        return filename, None, str(e)
+
+def renderFiles(filenames, outputDir=None, jobs=None, report=print, machine="zx", native=False, scale=1,
+                verbose=True):
+    """
+    Renders the files across a process pool, reporting failures and, if verbose, progress
+    as each completes. Returns the number of files that failed.
+    """
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_renderJob, filename, base, machine, native, scale)
+                   for filename, base in zip(filenames, outputBases(filenames, outputDir, machine, native))]
+        for count, future in enumerate(as_completed(futures), 1):
+            filename, output, error = future.result()
+            if error:
+                failed += 1
+                report("[{}/{}] {}: FAILED: {}".format(count, len(filenames), filename, error))
+            elif verbose:
+                report("[{}/{}] {} -> {}".format(count, len(filenames), filename, output))
+
+    elapsed = time.perf_counter() - start
+    report("Rendered {} of {} files in {:.2f}s ({:.1f} files/s)".format(
+        len(filenames) - failed, len(filenames), elapsed, len(filenames) / elapsed if elapsed else 0.0))
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render retro draw projects and .SCR files to PNG")
+    parser.add_argument("files", nargs="+", help="project (.rdp, .json), .scr or image files")
+    parser.add_argument("-o", "--output-dir", help="directory for the PNG files (default: next to each input)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("-m", "--machine", choices=sorted(MACHINES), default="zx",
+                        help="machine to convert image files for (default: zx)")
+    parser.add_argument("-n", "--native", action="store_true", help="also write each machine's own screen file")
+    parser.add_argument("-s", "--scale", type=int, default=1, help="integer upscale of the PNG files (default: 1)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print failures and the summary")
+    args = parser.parse_args(argv)
+
+    try:
+        failed = renderFiles(args.files, args.output_dir, args.jobs, print, args.machine, args.native, args.scale,
+                             not args.quiet)
+    except ValueError as e:
+        parser.error(str(e))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
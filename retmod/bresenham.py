@@ -1,56 +1,69 @@
-class BresenhamLine:
-    def __init__(self, start, end):
-        self.x = start[0]
-        self.y = start[1]
-        self.w = end[0] - self.x
-        self.h = end[1] - self.y
-        
-        self.dx1, self.dy1, self.dx2, self.dy2 = 0, 0, 0, 0
-        
-        if self.w < 0:
-            self.dx1 = -1
-            self.dx2 = -1
-        elif self.w > 0:
-            self.dx1 = 1
-            self.dx2 = 1
-        
-        if self.h < 0:
-            self.dy1 = -1
-        elif self.h > 0:
-            self.dy1 = 1
-
-        self.longest = abs(self.w)
-        self.shortest = abs(self.h)  
-        
-        if self.shortest >= self.longest:
-            self.longest, self.shortest = self.shortest, self.longest
-            if self.h < 0:
-                self.dy2 = -1
-            elif self.h > 0:
-                self.dy2 = 1
-            self.dx2 = 0
-                
-        self.numerator = self.longest / 2
-        self.count = 0
-        
-    def __iter__(self):
-        return self
-    
-    def __next__(self):
-        if self.count < self.longest:
-            retval = (self.x, self.y)
-            
-            self.numerator += self.shortest
-            
-            if self.numerator >= self.longest:
-                self.numerator -= self.longest
-                self.x += self.dx1
-                self.y += self.dy1
-            else:
-                self.x += self.dx2
-                self.y += self.dy2
-                
-            self.count += 1
-            return retval
-
-        raise StopIteration
+import numpy as np
+
+def polylinePoints(points):
+    """
+    Returns integer x and y arrays of every point along a polyline, including both ends.
+    All segments are rasterised at once with the same rounding as Bresenham's algorithm.
+    """
+    points = np.floor(np.asarray(points, dtype=np.float64)).astype(np.int64).reshape(-1, 2)
+    start = points[:-1]
+    delta = points[1:] - start
+    steps = np.abs(delta).max(axis=1)
+
+    # One entry per point for each segment, excluding the segment's end point which is
+    # the start of the next one
+    segment = np.repeat(np.arange(len(steps)), steps)
+    step = np.arange(segment.size) - np.repeat(np.cumsum(steps) - steps, steps)
+    length = steps[segment]
+    offset = (2 * step[:, np.newaxis] * np.abs(delta[segment]) + length[:, np.newaxis]) // \
+             (2 * length[:, np.newaxis])
+    line = start[segment] + np.sign(delta[segment]) * offset
+
+    line = np.concatenate([line, points[-1:]])
+    return line[:, 0], line[:, 1]
+
+def _box(start, end, bounds):
+    """
+    Returns the corners of the box with the start and end points at opposite corners, and
+    the part of it inside bounds (width, height) as ranges of columns and rows
+    """
+    (x1, y1), (x2, y2) = np.floor(np.asarray([start, end], dtype=np.float64)).astype(np.int64)
+    x1, x2 = min(x1, x2), max(x1, x2)
+    y1, y2 = min(y1, y2), max(y1, y2)
+    if bounds is None:
+        return (x1, y1, x2, y2), np.arange(x1, x2 + 1), np.arange(y1, y2 + 1)
+    return (x1, y1, x2, y2), np.arange(max(x1, 0), min(x2, bounds[0] - 1) + 1), \
+        np.arange(max(y1, 0), min(y2, bounds[1] - 1) + 1)
+
+def rectPoints(start, end, filled=False, bounds=None):
+    """
+    Returns integer x and y arrays of the outline, or the whole area, of the rectangle
+    with the start and end points at opposite corners, limited to bounds (width, height)
+    """
+    (x1, y1, x2, y2), xs, ys = _box(start, end, bounds)
+    x, y = np.meshgrid(xs, ys)
+    if not filled:
+        edge = (x == x1) | (x == x2) | (y == y1) | (y == y2)
+        x, y = x[edge], y[edge]
+    return x.ravel(), y.ravel()
+
+def ellipsePoints(start, end, filled=False, bounds=None):
+    """
+    Returns integer x and y arrays of the outline, or the whole area, of the ellipse
+    inscribed in the box with the start and end points at opposite corners, limited to
+    bounds (width, height). A pixel is inside if its centre is inside the ellipse; the
+    test uses doubled coordinates so it stays in integers for even and odd sizes alike.
+    """
+    (x1, y1, x2, y2), xs, ys = _box(start, end, bounds)
+    a = x2 - x1 + 1
+    b = y2 - y1 + 1
+
+    def inside(x, y):
+        return (2 * x - x1 - x2) ** 2 * (b * b) + (2 * y - y1 - y2) ** 2 * (a * a) <= (a * a) * (b * b)
+
+    x, y = np.meshgrid(xs, ys)
+    area = inside(x, y)
+    if not filled:
+        # The outline is the inside pixels with a 4-neighbour outside
+        area &= ~(inside(x - 1, y) & inside(x + 1, y) & inside(x, y - 1) & inside(x, y + 1))
+    return x[area], y[area]
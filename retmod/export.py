@@ -0,0 +1,203 @@
+"""
+Image export straight from a buffer's palette indices.
+
+Still images are written as palettised PNGs, and animations are streamed a frame at a
+time to animated GIF or APNG, so only one frame's pixels are ever held in memory.
+"""
+
+import io
+import os
+import zlib
+import struct
+import numpy as np
+from PIL import Image
+
+from retmod.zxbuffer import ZXSpectrumBuffer
+
+# Formats that can hold a palette; anything else is written as RGB
+INDEXED_EXTENSIONS = (".png", ".gif", ".bmp")
+
+def _bitDepth(colors):
+    """
+    Returns the smallest of 1, 2, 4 and 8 bits that can index the number of colours
+    """
+    for bits in (1, 2, 4):
+        if colors <= 1 << bits:
+            return bits
+    return 8
+
+def scaleFactors(buffer, scale=1):
+    """
+    Returns the (x, y) repeat of every pixel for an integer scale, also correcting the
+    machine's pixel aspect
+    """
+    if buffer.PIXEL_ASPECT > 1:
+        return scale * int(round(buffer.PIXEL_ASPECT)), scale
+    if buffer.PIXEL_ASPECT < 1:
+        return scale, scale * int(round(1 / buffer.PIXEL_ASPECT))
+    return scale, scale
+
+def scaledIndices(buffer, scale=1):
+    """
+    Returns the buffer's palette indices as an 8 bit array upscaled by scaleFactors
+    """
+    scaleX, scaleY = scaleFactors(buffer, scale)
+    indices = buffer.indexImage().astype(np.uint8, copy=False)
+    if scaleX > 1:
+        indices = np.repeat(indices, scaleX, axis=1)
+    if scaleY > 1:
+        indices = np.repeat(indices, scaleY, axis=0)
+    return np.ascontiguousarray(indices)
+
+def indexedImage(buffer, scale=1):
+    """
+    Returns the buffer as a palettised PIL image
+    """
+    indices = scaledIndices(buffer, scale)
+    palette = buffer.paletteLUT()
+    if len(palette) > 16:
+        # Keep only the colours in use, which usually allows a lower bit depth
+        used = np.flatnonzero(np.bincount(indices.ravel(), minlength=len(palette)))
+        remap = np.zeros(len(palette), dtype=np.uint8)
+        remap[used] = np.arange(len(used))
+        indices = remap[indices]
+        palette = palette[used]
+    image = Image.fromarray(indices)
+    image.putpalette(palette.tobytes())
+    return image
+
+def saveImage(buffer, filename, scale=1, format=None):
+    """
+    Writes the buffer to an image file, palettised where the format allows
+    """
+    image = indexedImage(buffer, scale)
+    extension = os.path.splitext(filename)[1].lower()
+    if (format or "").lower() not in ("", "png", "gif", "bmp") or (not format and extension not in INDEXED_EXTENSIONS):
+        image = image.convert("RGB")
+    image.save(filename, format)
+
+def _frameRuns(frames):
+    """
+    Returns (index, repeats) for every run of identical frames, which are written once
+    with a longer delay
+    """
+    runs = []
+    previous = None
+    for index in range(len(frames)):
+        key = frames.key(index)
+        if key == previous:
+            runs[-1][1] += 1
+        else:
+            runs.append([index, 1])
+        previous = key
+    return runs
+
+def _frameIndices(frames, scale):
+    """
+    Yields (palette indices, repeats) for each run of identical frames, decoding one at a time
+    """
+    renderer = ZXSpectrumBuffer()
+    for index, repeats in _frameRuns(frames):
+        frames.loadFrame(index, renderer)
+        yield scaledIndices(renderer, scale), repeats
+
+def _pngChunk(output, kind, data):
+    output.write(struct.pack(">I", len(data)) + kind + data)
+    output.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+def _pngRows(indices, bits):
+    """
+    Returns the zlib compressed scanlines of an index array at the bit depth, each
+    with no filter since runs of the same index already compress well
+    """
+    if bits < 8:
+        height, width = indices.shape
+        perByte = 8 // bits
+        padded = np.zeros((height, -(-width // perByte) * perByte), dtype=np.uint8)
+        padded[:, :width] = indices
+        packed = np.zeros((height, padded.shape[1] // perByte), dtype=np.uint8)
+        for pixel in range(perByte):
+            packed |= padded[:, pixel::perByte] << (8 - bits * (pixel + 1))
+        indices = packed
+    rows = np.zeros((indices.shape[0], indices.shape[1] + 1), dtype=np.uint8)
+    rows[:, 1:] = indices
+    return zlib.compress(rows.tobytes())
+
+def saveAPNG(frames, filename, fps, scale=1, loop=0):
+    """
+    Streams a frame sequence to an animated PNG
+    """
+    palette = ZXSpectrumBuffer.paletteLUT()
+    bits = _bitDepth(len(palette))
+    runs = _frameRuns(frames)
+    width, height = ZXSpectrumBuffer.WIDTH * scale, ZXSpectrumBuffer.HEIGHT * scale
+
+    with open(filename, "wb") as output:
+        output.write(b"\x89PNG\r\n\x1a\n")
+        _pngChunk(output, b"IHDR", struct.pack(">IIBBBBB", width, height, bits, 3, 0, 0, 0))
+        _pngChunk(output, b"PLTE", palette.tobytes())
+        _pngChunk(output, b"acTL", struct.pack(">II", len(runs), loop))
+        sequence = 0
+        for number, (indices, repeats) in enumerate(_frameIndices(frames, scale)):
+            _pngChunk(output, b"fcTL", struct.pack(">IIIIIHHBB", sequence, width, height, 0, 0, repeats, fps, 0, 0))
+            sequence += 1
+            data = _pngRows(indices, bits)
+            if number == 0:
+                _pngChunk(output, b"IDAT", data)
+            else:
+                _pngChunk(output, b"fdAT", struct.pack(">I", sequence) + data)
+                sequence += 1
+        _pngChunk(output, b"IEND", b"")
+
+def _gifImageBlock(image):
+    """
+    Returns the image descriptor and LZW data of a single frame GIF encoded by PIL
+    """
+    encoded = io.BytesIO()
+    image.save(encoded, "GIF", optimize=False)
+    data = encoded.getvalue()
+    position = 13
+    if data[10] & 0x80:
+        position += 3 << ((data[10] & 0x07) + 1)
+    # Skip any extensions PIL wrote before the image
+    while data[position] == 0x21:
+        position += 2
+        while data[position]:
+            position += data[position] + 1
+        position += 1
+    return data[position:-1]
+
+def saveGIF(frames, filename, fps, scale=1, loop=0):
+    """
+    Streams a frame sequence to an animated GIF. Delays are in hundredths of a second,
+    so they are rounded against the running time to keep the overall speed exact.
+    """
+    palette = ZXSpectrumBuffer.paletteLUT()
+    bits = max(_bitDepth(len(palette)), 2)
+    width, height = ZXSpectrumBuffer.WIDTH * scale, ZXSpectrumBuffer.HEIGHT * scale
+
+    with open(filename, "wb") as output:
+        output.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xf0 | (bits - 1), 0, 0))
+        table = np.zeros((1 << bits, 3), dtype=np.uint8)
+        table[:len(palette)] = palette
+        output.write(table.tobytes())
+        output.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+        elapsed = 0
+        for indices, repeats in _frameIndices(frames, scale):
+            delay = int(round((elapsed + repeats) * 100 / fps)) - int(round(elapsed * 100 / fps))
+            elapsed += repeats
+            output.write(b"\x21\xf9\x04\x00" + struct.pack("<H", delay) + b"\x00\x00")
+            image = Image.fromarray(indices)
+            image.putpalette(table.tobytes())
+            output.write(_gifImageBlock(image))
+        output.write(b"\x3b")
+
+def saveAnimation(frames, filename, fps, scale=1, loop=0):
+    """
+    Streams a frame sequence to an animated GIF, or to an APNG for any other extension
+    """
+    if os.path.splitext(filename)[1].lower() == ".gif":
+        saveGIF(frames, filename, fps, scale, loop)
+    else:
+        saveAPNG(frames, filename, fps, scale, loop)
@@ -0,0 +1,108 @@
+import zlib
+import numpy as np
+
+class _Delta(object):
+    """
+    The screen bytes an edit changed, with their values before and after it
+    """
+    def __init__(self, before, after):
+        self._offsets = np.flatnonzero(before != after).astype(np.uint16)
+        self._before = before[self._offsets]
+        self._after = after[self._offsets]
+
+    @property
+    def nbytes(self):
+        return self._offsets.nbytes + self._before.nbytes + self._after.nbytes
+
+    def undo(self, buffer):
+        buffer.writeScreenBytes(self._offsets, self._before)
+
+    def redo(self, buffer):
+        buffer.writeScreenBytes(self._offsets, self._after)
+
+class _Snapshot(object):
+    """
+    Compressed copies of the whole screen before and after a bulk edit
+    """
+    def __init__(self, before, after):
+        self._before = zlib.compress(before.tobytes())
+        self._after = zlib.compress(after.tobytes())
+
+    @property
+    def nbytes(self):
+        return len(self._before) + len(self._after)
+
+    def undo(self, buffer):
+        buffer.setScreen(zlib.decompress(self._before))
+
+    def redo(self, buffer):
+        buffer.setScreen(zlib.decompress(self._after))
+
+class UndoHistory(object):
+    """
+    Undo/redo history for a buffer. Each edit between begin() and end() is stored as the
+    bytes it changed, or as a compressed snapshot for bulk edits where that is smaller.
+    The oldest edits are dropped once the history holds more than maxBytes.
+    """
+    def __init__(self, buffer, maxBytes=1 << 20):
+        self._buffer = buffer
+        self._maxBytes = maxBytes
+        self._undo = []
+        self._redo = []
+        self._before = None
+
+    @property
+    def nbytes(self):
+        return sum(edit.nbytes for edit in self._undo + self._redo)
+
+    def canUndo(self):
+        return len(self._undo) > 0
+
+    def canRedo(self):
+        return len(self._redo) > 0
+
+    def clear(self):
+        self._undo = []
+        self._redo = []
+        self._before = None
+
+    def begin(self):
+        if self._before is None:
+            self._before = self._buffer.screen.copy()
+
+    def end(self):
+        if self._before is None:
+            return
+
+        before, self._before = self._before, None
+        after = self._buffer.screen
+        changed = np.count_nonzero(before != after)
+        if changed == 0:
+            return
+
+        edit = _Delta(before, after)
+        if edit.nbytes > len(before) // 2:
+            snapshot = _Snapshot(before, after)
+            if snapshot.nbytes < edit.nbytes:
+                edit = snapshot
+
+        self._undo.append(edit)
+        self._redo = []
+
+        total = self.nbytes
+        while total > self._maxBytes and len(self._undo) > 1:
+            total -= self._undo.pop(0).nbytes
+
+    def undo(self):
+        self.end()
+        if self._undo:
+            edit = self._undo.pop()
+            edit.undo(self._buffer)
+            self._redo.append(edit)
+
+    def redo(self):
+        self.end()
+        if self._redo:
+            edit = self._redo.pop()
+            edit.redo(self._buffer)
+            self._undo.append(edit)
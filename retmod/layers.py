@@ -0,0 +1,129 @@
+import numpy as np
+
+from retmod.zxbuffer import ZXSpectrumBuffer
+from retmod.history import UndoHistory
+from retmod.animation import FrameSequence
+
+class Layer(object):
+    """
+    One layer of a stack: a buffer with its own undo history and animation frames, of which
+    the buffer holds the one being edited. Unset pixels are transparent.
+    The attributes of a layer only show in the cells where it has set pixels, and only if
+    it overrides the attributes of the layers below; the bottom layer always provides them.
+    """
+    def __init__(self, name, buffer=None, visible=True, overrideAttributes=False):
+        self.name = name
+        self.buffer = buffer if buffer is not None else ZXSpectrumBuffer()
+        self.history = UndoHistory(self.buffer)
+        self.frames = FrameSequence()
+        self.frames.insertFrame(0, self.buffer)
+        self.visible = visible
+        self.overrideAttributes = overrideAttributes
+
+class LayerStack(object):
+    """
+    A stack of layers, bottom first, flattened into a composite buffer. Only the cells that
+    changed on some layer since the last flatten are recomposed.
+    """
+    def __init__(self):
+        self.composite = ZXSpectrumBuffer()
+        self.reset()
+
+    def __len__(self):
+        return len(self._layers)
+
+    def __getitem__(self, index):
+        return self._layers[index]
+
+    def reset(self):
+        """
+        Replaces the stack with a single empty background layer
+        """
+        self.restore([Layer("Background")])
+
+    def restore(self, layers, activeIndex=0):
+        self._layers = list(layers)
+        self._activeIndex = max(0, min(activeIndex, len(self._layers) - 1))
+        self._stale = np.ones(self.composite.sizeAttr[::-1], dtype=bool)
+        for layer in self._layers:
+            layer.buffer.takeDirtyCells()
+
+    @property
+    def active(self):
+        return self._layers[self._activeIndex]
+
+    @property
+    def activeIndex(self):
+        return self._activeIndex
+
+    def setActive(self, index):
+        self._activeIndex = max(0, min(index, len(self._layers) - 1))
+
+    def addLayer(self, name=None):
+        """
+        Adds an empty layer above the active one and makes it active
+        """
+        layer = Layer(name or "Layer {}".format(len(self._layers)))
+        self._layers.insert(self._activeIndex + 1, layer)
+        self._activeIndex += 1
+        layer.buffer.takeDirtyCells()
+        return layer
+
+    def removeLayer(self, index):
+        if len(self._layers) > 1:
+            del self._layers[index]
+            self._activeIndex = max(0, min(self._activeIndex, len(self._layers) - 1))
+            self.markAll()
+
+    def moveLayer(self, index, newIndex):
+        newIndex = max(0, min(newIndex, len(self._layers) - 1))
+        if newIndex != index:
+            active = self.active
+            self._layers.insert(newIndex, self._layers.pop(index))
+            self._activeIndex = self._layers.index(active)
+            self.markAll()
+
+    def setVisible(self, index, visible):
+        self._layers[index].visible = visible
+        self.markAll()
+
+    def setOverrideAttributes(self, index, override):
+        self._layers[index].overrideAttributes = override
+        self.markAll()
+
+    def markAll(self):
+        self._stale[:] = True
+
+    def flatten(self):
+        """
+        Recomposes the cells changed on any layer into the composite, which marks them dirty
+        """
+        for layer in self._layers:
+            for x, y in layer.buffer.takeDirtyCells():
+                self._stale[y, x] = True
+        if not self._stale.any():
+            return
+
+        ys, xs = np.nonzero(self._stale)
+        self._stale[:] = False
+
+        # With every layer hidden the composite is blank in the bottom layer's attributes
+        visible = [layer for layer in self._layers if layer.visible] or self._layers[:1]
+        attributes = visible[0].buffer.attributes[ys, xs]
+        cells = np.zeros((len(xs), 8), dtype=np.uint8)
+        for layer in visible:
+            layerCells = layer.buffer.getCells(xs, ys)
+            if layer.visible:
+                cells |= layerCells
+            if layer.overrideAttributes and layer is not visible[0]:
+                inked = layerCells.any(axis=1)
+                attributes[inked] = layer.buffer.attributes[ys[inked], xs[inked]]
+        self.composite.setCells(xs, ys, cells, attributes)
+
+    @property
+    def flattened(self):
+        """
+        The composite buffer, flattened first if any layer has changed
+        """
+        self.flatten()
+        return self.composite
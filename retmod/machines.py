@@ -0,0 +1,264 @@
+"""
+Buffers for machines other than the ZX Spectrum.
+
+They share one array-backed model, CellColorBuffer: every pixel holds a colour slot and
+every cell of CELL_WIDTH x CELL_HEIGHT pixels maps its SLOTS slots to palette colours.
+The first SHARED_SLOTS slots have the same colour in every cell. Machines with a
+screen-wide set of pens use a single cell covering the whole screen.
+"""
+
+import os
+import numpy as np
+
+from retmod.retrobuffer import RetroBuffer
+from retmod.zxbuffer import ZXSpectrumBuffer
+
+class CellColorBuffer(RetroBuffer):
+    """
+    A bitmap whose cells can each show SLOTS colours of the machine palette
+    """
+    SLOTS = 2
+    SHARED_SLOTS = 0
+
+    def __init__(self, color=0):
+        super(CellColorBuffer, self).__init__()
+        cellsX, cellsY = self.sizeAttr
+        self._pixels = np.zeros((self.HEIGHT, self.WIDTH), dtype=np.uint8)
+        self._cellColors = np.zeros((cellsY, cellsX, self.SLOTS), dtype=np.uint8)
+
+        # Flat cell number of every pixel, for gathering cell colours in one step
+        ys, xs = np.indices((self.HEIGHT, self.WIDTH))
+        self._cellIndex = (ys // self.CELL_HEIGHT) * cellsX + xs // self.CELL_WIDTH
+
+        self.clear(color)
+
+    @property
+    def pixels(self):
+        """
+        The colour slot of every pixel as a (height, width) array
+        """
+        return self._pixels
+
+    @property
+    def cellColors(self):
+        """
+        The palette colour of every slot of every cell as a (cells y, cells x, slots) array
+        """
+        return self._cellColors
+
+    def indexImage(self):
+        return self._cellColors.reshape(-1, self.SLOTS)[self._cellIndex, self._pixels]
+
+    def clear(self, color=0):
+        self._pixels[:] = 0
+        self._cellColors[:] = color
+        self._markAllDirty()
+
+    def getPixel(self, x, y):
+        return int(self._cellColors[y // self.CELL_HEIGHT, x // self.CELL_WIDTH, self._pixels[y, x]])
+
+    def setSharedColor(self, slot, color):
+        self._cellColors[..., slot] = color
+        self._markAllDirty()
+
+    def setPixel(self, x, y, color):
+        self.setPixels(np.array([int(x)]), np.array([int(y)]), color)
+
+    def setPixels(self, x, y, color):
+        """
+        Sets all the pixels at the x and y integer arrays to a palette colour, ignoring any
+        off screen. A cell without the colour takes it into its least used own slot, which
+        recolours whatever else was in that slot, as the real hardware would.
+        """
+        inside = (x >= 0) & (x < self.WIDTH) & (y >= 0) & (y < self.HEIGHT)
+        x = x[inside]
+        y = y[inside]
+        if x.size == 0:
+            return
+
+        cellX = x // self.CELL_WIDTH
+        cellY = y // self.CELL_HEIGHT
+        match = self._cellColors[cellY, cellX] == color
+        slots = match.argmax(axis=1)
+
+        # Only cells that lack the colour need a slot choosing, once per cell
+        missing = ~match.any(axis=1)
+        if missing.any():
+            cells = np.unique(np.stack([cellY[missing], cellX[missing]], axis=1), axis=0)
+            for cy, cx in cells.tolist():
+                block = self._pixels[cy * self.CELL_HEIGHT:(cy + 1) * self.CELL_HEIGHT,
+                                     cx * self.CELL_WIDTH:(cx + 1) * self.CELL_WIDTH]
+                used = np.bincount(block.ravel(), minlength=self.SLOTS)[self.SHARED_SLOTS:]
+                slot = self.SHARED_SLOTS + int(used.argmin())
+                self._cellColors[cy, cx, slot] = color
+                slots[missing & (cellY == cy) & (cellX == cx)] = slot
+
+        self._pixels[y, x] = slots
+        self._dirtyCells[cellY, cellX] = True
+        self._needsUpdate = True
+
+    def importImage(self, rgb):
+        """
+        Replaces the whole screen from a (height, width, 3) RGB array. The shared slots get
+        the most common colours of the image, each cell's own slots its most common other
+        colours, and every pixel the closest colour its cell can show.
+        """
+        rgb = np.asarray(rgb)
+        if rgb.shape != (self.HEIGHT, self.WIDTH, 3):
+            raise ValueError("Image shape {} does not match the screen size {}x{}".
+                             format(rgb.shape, self.WIDTH, self.HEIGHT))
+
+        palette = self.paletteLUT().astype(np.int64)
+        cellIndex = self._cellIndex.ravel()
+
+        # Distance from every pixel to every palette colour, less the pixel's own squared
+        # length which makes no difference to which colour is closest
+        distance = (palette ** 2).sum(axis=1) - 2 * rgb.reshape(-1, 3).astype(np.int64) @ palette.T
+        nearest = distance.argmin(axis=1)
+
+        cells = self._cellColors.shape[0] * self._cellColors.shape[1]
+        counts = np.bincount(cellIndex * len(palette) + nearest,
+                             minlength=cells * len(palette)).reshape(cells, len(palette))
+        shared = np.argsort(-counts.sum(axis=0), kind="stable")[:self.SHARED_SLOTS]
+        counts[:, shared] = -1
+        own = np.argsort(-counts, axis=1, kind="stable")[:, :self.SLOTS - self.SHARED_SLOTS]
+
+        colors = self._cellColors.reshape(cells, self.SLOTS)
+        colors[:, :self.SHARED_SLOTS] = shared
+        colors[:, self.SHARED_SLOTS:] = own
+
+        slots = np.take_along_axis(distance, colors[cellIndex].astype(np.intp), axis=1).argmin(axis=1)
+        self._pixels[:] = slots.reshape(self._pixels.shape)
+        self._markAllDirty()
+
+class C64MulticolourBuffer(CellColorBuffer):
+    """
+    Commodore 64 multicolour bitmap: 160x200 double-wide pixels with a shared background
+    colour and three colours of its own per 4x8 cell. Native files are Koala Painter.
+    """
+    WIDTH = 160
+    HEIGHT = 200
+    CELL_WIDTH = 4
+    CELL_HEIGHT = 8
+    PIXEL_ASPECT = 2
+    SLOTS = 4
+    SHARED_SLOTS = 1
+    NATIVE_EXTENSION = ".kla"
+    PALETTE = ((0x00, 0x00, 0x00), (0xff, 0xff, 0xff), (0x88, 0x00, 0x00), (0xaa, 0xff, 0xee),
+               (0xcc, 0x44, 0xcc), (0x00, 0xcc, 0x55), (0x00, 0x00, 0xaa), (0xee, 0xee, 0x77),
+               (0xdd, 0x88, 0x55), (0x66, 0x44, 0x00), (0xff, 0x77, 0x77), (0x33, 0x33, 0x33),
+               (0x77, 0x77, 0x77), (0xaa, 0xff, 0x66), (0x00, 0x88, 0xff), (0xbb, 0xbb, 0xbb))
+
+    def saveNative(self, filename):
+        """
+        Writes a Koala Painter file: load address, bitmap by cell, screen RAM (slots 1 and
+        2), colour RAM (slot 3) and the background colour (slot 0)
+        """
+        pixels = self._pixels.reshape(25, 8, 40, 4).transpose(0, 2, 1, 3)
+        bitmap = (pixels[..., 0] << 6) | (pixels[..., 1] << 4) | (pixels[..., 2] << 2) | pixels[..., 3]
+        screen = (self._cellColors[..., 1] << 4) | self._cellColors[..., 2]
+        with open(filename, "wb") as output:
+            output.write(b"\x00\x60")
+            output.write(bitmap.astype(np.uint8).tobytes())
+            output.write(screen.astype(np.uint8).tobytes())
+            output.write(self._cellColors[..., 3].tobytes())
+            output.write(self._cellColors[:1, :1, 0].tobytes())
+
+class MSXScreen2Buffer(CellColorBuffer):
+    """
+    MSX Screen 2: 256x192 pixels with a foreground and background colour per 8x1 cell.
+    Slot 0 is the background. Native files are BSAVE dumps of video memory.
+    """
+    WIDTH = 256
+    HEIGHT = 192
+    CELL_WIDTH = 8
+    CELL_HEIGHT = 1
+    SLOTS = 2
+    NATIVE_EXTENSION = ".sc2"
+    # Colour 0 is transparent, which shows as black over the default backdrop
+    PALETTE = ((0x00, 0x00, 0x00), (0x00, 0x00, 0x00), (0x21, 0xc8, 0x42), (0x5e, 0xdc, 0x78),
+               (0x54, 0x55, 0xed), (0x7d, 0x76, 0xfc), (0xd4, 0x52, 0x4d), (0x42, 0xeb, 0xf5),
+               (0xfc, 0x55, 0x54), (0xff, 0x79, 0x78), (0xd4, 0xc1, 0x54), (0xe6, 0xce, 0x80),
+               (0x21, 0xb0, 0x3b), (0xc9, 0x5b, 0xba), (0xcc, 0xcc, 0xcc), (0xff, 0xff, 0xff))
+
+    def saveNative(self, filename):
+        """
+        Writes the pattern, name, sprite attribute and colour tables as a BSAVE file
+        """
+        # Pattern and colour bytes are ordered by third, character and line
+        order = (0, 1, 3, 2)
+        patterns = np.packbits(self._pixels == 1, axis=1).reshape(3, 8, 8, 32).transpose(order)
+        colors = ((self._cellColors[..., 1] << 4) | self._cellColors[..., 0]).reshape(3, 8, 8, 32).transpose(order)
+
+        vram = np.zeros(0x3800, dtype=np.uint8)
+        vram[0x0000:0x1800] = patterns.ravel()
+        vram[0x1800:0x1b00] = np.tile(np.arange(256, dtype=np.uint8), 3)
+        vram[0x1b00] = 0xd0
+        vram[0x2000:0x3800] = colors.ravel()
+        with open(filename, "wb") as output:
+            output.write(bytes([0xfe]) + (0).to_bytes(2, "little") + (len(vram) - 1).to_bytes(2, "little") +
+                         (0).to_bytes(2, "little"))
+            output.write(vram.tobytes())
+
+# Hardware colour levels of each of the CPC's RGB guns
+_CPC_LEVELS = (0x00, 0x80, 0xff)
+
+class CPCBuffer(CellColorBuffer):
+    """
+    Amstrad CPC screen, with pens shared by the whole screen chosen from the 27 hardware
+    colours, which are numbered as the firmware does: 9 * green + 3 * red + blue.
+    Native files are the 16K of screen memory, with the pens' colours in a .pal file.
+    """
+    HEIGHT = 200
+    CELL_HEIGHT = 200
+    SHARED_SLOTS = 0
+    NATIVE_EXTENSION = ".bin"
+    PALETTE = tuple((_CPC_LEVELS[(n // 3) % 3], _CPC_LEVELS[n // 9], _CPC_LEVELS[n % 3]) for n in range(27))
+    # Bit of the screen byte holding each bit of each pixel's pen, leftmost pixel first
+    PEN_BITS = None
+
+    def saveNative(self, filename):
+        pixels = self._pixels.reshape(self.HEIGHT, -1, len(self.PEN_BITS))
+        data = np.zeros(pixels.shape[:2], dtype=np.uint8)
+        for pixel, bits in enumerate(self.PEN_BITS):
+            for penBit, bit in enumerate(bits):
+                data |= (((pixels[..., pixel] >> penBit) & 1) << bit).astype(np.uint8)
+
+        # Line y is at (y % 8) * 2048 + (y // 8) * 80
+        screen = np.zeros(0x4000, dtype=np.uint8)
+        lines = np.arange(self.HEIGHT)
+        offsets = ((lines % 8) * 0x800 + (lines // 8) * 80)[:, np.newaxis] + np.arange(80)
+        screen[offsets] = data
+        with open(filename, "wb") as output:
+            output.write(screen.tobytes())
+        with open(os.path.splitext(filename)[0] + ".pal", "wb") as output:
+            output.write(self._cellColors[0, 0].tobytes())
+
+class CPCMode0Buffer(CPCBuffer):
+    WIDTH = 160
+    CELL_WIDTH = 160
+    PIXEL_ASPECT = 2
+    SLOTS = 16
+    PEN_BITS = ((7, 3, 5, 1), (6, 2, 4, 0))
+
+class CPCMode1Buffer(CPCBuffer):
+    WIDTH = 320
+    CELL_WIDTH = 320
+    SLOTS = 4
+    PEN_BITS = ((7, 3), (6, 2), (5, 1), (4, 0))
+
+class CPCMode2Buffer(CPCBuffer):
+    WIDTH = 640
+    CELL_WIDTH = 640
+    PIXEL_ASPECT = 0.5
+    SLOTS = 2
+    PEN_BITS = tuple((7 - pixel,) for pixel in range(8))
+
+MACHINES = {
+    "zx": ZXSpectrumBuffer,
+    "c64": C64MulticolourBuffer,
+    "msx": MSXScreen2Buffer,
+    "cpc0": CPCMode0Buffer,
+    "cpc1": CPCMode1Buffer,
+    "cpc2": CPCMode2Buffer,
+}
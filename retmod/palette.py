@@ -9,13 +9,14 @@ class PaletteSelectorLayout(QGroupBox):
     """
     Qt Layout class for a palette
     """
-    def __init__(self, fgIndex, bgIndex, palette, informFunction, parent=None):
+    def __init__(self, fgIndex, bgIndex, palette, informFunction, parent=None, flash=False):
         super(PaletteSelectorLayout, self).__init__("", parent)
         
         if ZXAttribute.paletteCount() != 2:
             raise Exception("The palette selector is current designed for 2 palettes only")
 
         self._bright = palette
+        self._flash = flash
         self._fgIndex = fgIndex
         self._bgIndex = bgIndex
         self._informFunction = informFunction
@@ -33,6 +34,12 @@ class PaletteSelectorLayout(QGroupBox):
             bright_select.setChecked(True)
         bright_select.clicked.connect(self._brightSelect)
 
+        # Add check box to select flashing
+        flash_select = QCheckBox("Flash Enabled")
+        vert_layout.addWidget(flash_select)
+        flash_select.setChecked(flash)
+        flash_select.clicked.connect(self._flashSelect)
+
         vert_layout.addSpacing(10)
 
         # Foreground color checkboxes
@@ -73,22 +80,31 @@ class PaletteSelectorLayout(QGroupBox):
             self._bright = 0
         else:
             self._bright = 1
-        self._informFunction(self.fgIndex, self.bgIndex, self.palette)
+        self._informFunction(self.fgIndex, self.bgIndex, self.palette, self.flash)
+
+    @Slot()
+    def _flashSelect(self, checked):
+        self._flash = checked
+        self._informFunction(self.fgIndex, self.bgIndex, self.palette, self.flash)
 
     @Slot()
     def _fgIndexSelect(self, checked):
         self._fgIndex = self._fg_group.id(self.sender())
-        self._informFunction(self.fgIndex, self.bgIndex, self.palette)
+        self._informFunction(self.fgIndex, self.bgIndex, self.palette, self.flash)
 
     @Slot()
     def _bgIndexSelect(self, checked):
         self._bgIndex = self._bg_group.id(self.sender())
-        self._informFunction(self.fgIndex, self.bgIndex, self.palette)
+        self._informFunction(self.fgIndex, self.bgIndex, self.palette, self.flash)
 
     @property
     def palette(self):
         return self._bright
 
+    @property
+    def flash(self):
+        return self._flash
+
     @property
     def fgIndex(self):
         return self._fgIndex
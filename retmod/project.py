@@ -0,0 +1,147 @@
+"""
+Binary project container.
+
+A project file is a small fixed header followed by the widget settings, the guide
+filename and the 6912 byte .SCR image of the buffer, which may be zlib compressed:
+
+    magic       4s  b"RDRW"
+    version     H
+    flags       H   FLAG_COMPRESSED, FLAG_LAYERS
+    settings    see _SETTINGS
+    guide name  H length + UTF-8 bytes
+    screen      I length + bytes
+
+With FLAG_LAYERS the screen is the flattened image and the layers follow it, so
+readers that only want the image can stop there:
+
+    count       H
+    active      H
+    per layer   B LAYER_VISIBLE, LAYER_OVERRIDE_ATTRIBUTES
+                H length + UTF-8 name
+                I length + screen bytes, compressed like the flattened screen
+"""
+
+import json
+import struct
+import zlib
+
+from retmod.layers import Layer
+
+MAGIC = b"RDRW"
+VERSION = 2
+
+FLAG_COMPRESSED = 0x0001
+FLAG_LAYERS = 0x0002
+
+LAYER_VISIBLE = 0x01
+LAYER_OVERRIDE_ATTRIBUTES = 0x02
+
+_HEADER = struct.Struct("<4sHH")
+_SETTINGS = struct.Struct("<BBB?d?diid")
+_LENGTH16 = struct.Struct("<H")
+_LENGTH32 = struct.Struct("<I")
+_LAYERS = struct.Struct("<HH")
+_LAYER_FLAGS = struct.Struct("<B")
+
+def _packBlock(length, data):
+    return length.pack(len(data)) + data
+
+def _unpackBlock(length, data, offset):
+    size, = length.unpack_from(data, offset)
+    offset += length.size
+    return data[offset:offset + size], offset + size
+
+def encodeProject(settings, buffer, compress=True, layers=None):
+    """
+    Returns the binary project for the widget settings dictionary and buffer, followed by
+    the layers of a LayerStack if given, in which case buffer should be its flattened image
+    """
+    def screenBytes(buffer):
+        screen = buffer.screen.tobytes()
+        return zlib.compress(screen, 9) if compress else screen
+
+    flags = (FLAG_COMPRESSED if compress else 0) | (FLAG_LAYERS if layers is not None else 0)
+    guideFilename = (settings["guide_filename"] or "").encode("utf-8")
+    screen = screenBytes(buffer)
+
+    layerBlocks = []
+    if layers is not None:
+        layerBlocks.append(_LAYERS.pack(len(layers), layers.activeIndex))
+        for layer in layers:
+            layerFlags = (LAYER_VISIBLE if layer.visible else 0) | \
+                         (LAYER_OVERRIDE_ATTRIBUTES if layer.overrideAttributes else 0)
+            layerBlocks += [_LAYER_FLAGS.pack(layerFlags), _packBlock(_LENGTH16, layer.name.encode("utf-8")),
+                            _packBlock(_LENGTH32, screenBytes(layer.buffer))]
+
+    return b"".join([_HEADER.pack(MAGIC, VERSION, flags),
+                     _SETTINGS.pack(settings["fg_index"], settings["bg_index"], settings["palette"],
+                                    settings["grid_enabled"], settings["grid_opacity"],
+                                    settings["guide_enabled"], settings["guide_opacity"],
+                                    settings["guide_coords_x"], settings["guide_coords_y"],
+                                    settings["guide_zoom"]),
+                     _LENGTH16.pack(len(guideFilename)), guideFilename,
+                     _LENGTH32.pack(len(screen)), screen] + layerBlocks)
+
+def decodeProject(data, buffer, layers=None):
+    """
+    Restores the buffer from a binary project in bulk and returns the widget settings
+    dictionary. If layers is a LayerStack it is restored from the project's layers, if any.
+    """
+    magic, version, flags = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a retro draw project")
+    if version > VERSION:
+        raise ValueError("Project version {} is newer than the supported version {}".format(version, VERSION))
+    offset = _HEADER.size
+
+    keys = ("fg_index", "bg_index", "palette", "grid_enabled", "grid_opacity", "guide_enabled",
+            "guide_opacity", "guide_coords_x", "guide_coords_y", "guide_zoom")
+    settings = dict(zip(keys, _SETTINGS.unpack_from(data, offset)))
+    offset += _SETTINGS.size
+
+    length, = _LENGTH16.unpack_from(data, offset)
+    offset += _LENGTH16.size
+    settings["guide_filename"] = data[offset:offset + length].decode("utf-8") or None
+    offset += length
+
+    def screenBytes(offset):
+        screen, offset = _unpackBlock(_LENGTH32, data, offset)
+        return zlib.decompress(screen) if flags & FLAG_COMPRESSED else screen, offset
+
+    screen, offset = screenBytes(offset)
+    buffer.setScreen(screen)
+
+    if layers is not None and flags & FLAG_LAYERS:
+        count, activeIndex = _LAYERS.unpack_from(data, offset)
+        offset += _LAYERS.size
+        restored = []
+        for i in range(count):
+            layerFlags, = _LAYER_FLAGS.unpack_from(data, offset)
+            name, offset = _unpackBlock(_LENGTH16, data, offset + _LAYER_FLAGS.size)
+            screen, offset = screenBytes(offset)
+            layer = Layer(name.decode("utf-8"), visible=bool(layerFlags & LAYER_VISIBLE),
+                          overrideAttributes=bool(layerFlags & LAYER_OVERRIDE_ATTRIBUTES))
+            layer.buffer.setScreen(screen)
+            restored.append(layer)
+        layers.restore(restored, activeIndex)
+
+    return settings
+
+def saveProject(filename, settings, buffer, compress=True, layers=None):
+    with open(filename, "wb") as output:
+        output.write(encodeProject(settings, buffer, compress, layers))
+
+def loadProject(filename, buffer, layers=None):
+    """
+    Loads a binary project, or a JSON project from before the binary format, into the
+    buffer and the layers if given, and returns the widget settings dictionary
+    """
+    with open(filename, "rb") as input:
+        data = input.read()
+
+    if data.startswith(MAGIC):
+        return decodeProject(data, buffer, layers)
+
+    settings = json.loads(data.decode("utf-8"))
+    buffer.decodeFromJSON(settings.pop("drawable"))
+    return settings
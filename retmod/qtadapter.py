@@ -0,0 +1,40 @@
+"""
+Conversions between the Qt-free buffers and Qt images. Only the UI imports this module.
+"""
+
+from PySide6.QtGui import QImage, QPixmap, QPainter
+import numpy as np
+
+def rgbToQImage(rgb):
+    """
+    Returns a QImage of a (height, width, 3) RGB array. The image shares the array's memory.
+    """
+    return QImage(rgb.data, rgb.shape[1], rgb.shape[0], rgb.strides[0], QImage.Format_RGB888)
+
+def rgbToQPixmap(rgb):
+    return QPixmap.fromImage(rgbToQImage(rgb))
+
+def drawRGB(pixmap, x, y, rgb):
+    """
+    Draws a (height, width, 3) RGB array into part of a pixmap, with its top left at x, y
+    """
+    painter = QPainter(pixmap)
+    painter.drawImage(x, y, rgbToQImage(np.ascontiguousarray(rgb)))
+    painter.end()
+
+def qimageToRGB(image):
+    """
+    Returns an RGB copy of a QImage as a (height, width, 3) array of bytes
+    """
+    image = image.convertToFormat(QImage.Format_RGB888)
+    data = np.frombuffer(image.constBits(), dtype=np.uint8, count=image.sizeInBytes())
+    data = data.reshape(image.height(), image.bytesPerLine())[:, :image.width() * 3]
+    return data.reshape(image.height(), image.width(), 3).copy()
+
+def qimageToArray(image):
+    """
+    Returns a greyscale copy of a QImage as a (height, width) array of bytes
+    """
+    image = image.convertToFormat(QImage.Format_Grayscale8)
+    data = np.frombuffer(image.constBits(), dtype=np.uint8, count=image.sizeInBytes())
+    return data.reshape(image.height(), image.bytesPerLine())[:, :image.width()].copy()
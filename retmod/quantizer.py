@@ -0,0 +1,110 @@
+from enum import Enum
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+class Dither(Enum):
+    NONE = 1
+    ORDERED = 2
+    DIFFUSION = 3
+
+# 8x8 Bayer matrix normalised to thresholds in (0, 1); a cell is exactly one tile of it
+_BAYER = np.array([[ 0, 32,  8, 40,  2, 34, 10, 42],
+                   [48, 16, 56, 24, 50, 18, 58, 26],
+                   [12, 44,  4, 36, 14, 46,  6, 38],
+                   [60, 28, 52, 20, 62, 30, 54, 22],
+                   [ 3, 35, 11, 43,  1, 33,  9, 41],
+                   [51, 19, 59, 27, 49, 17, 57, 25],
+                   [15, 47,  7, 39, 13, 45,  5, 37],
+                   [63, 31, 55, 23, 61, 29, 53, 21]], dtype=np.float32).reshape(64)
+_BAYER = (_BAYER + 0.5) / 64.0
+
+def _candidatePairs(paletteSize, paletteCount):
+    """
+    Returns the (paper, ink) LUT index pairs a cell may use; both colors share a palette
+    """
+    paper, ink = [], []
+    for palette in range(0, paletteCount):
+        for i in range(0, paletteSize):
+            for j in range(i + 1, paletteSize):
+                paper.append(palette * paletteSize + i)
+                ink.append(palette * paletteSize + j)
+    return np.array(paper), np.array(ink)
+
+def _diffuse(t):
+    """
+    Floyd-Steinberg error diffusion of (cells, 64) ink fractions, confined to each cell
+    """
+    t = t.reshape(-1, 8, 8).copy()
+    ink = np.zeros(t.shape, dtype=bool)
+    for y in range(0, 8):
+        for x in range(0, 8):
+            ink[:, y, x] = t[:, y, x] >= 0.5
+            error = t[:, y, x] - ink[:, y, x]
+            if x < 7:
+                t[:, y, x + 1] += error * (7 / 16)
+            if y < 7:
+                if x > 0:
+                    t[:, y + 1, x - 1] += error * (3 / 16)
+                t[:, y + 1, x] += error * (5 / 16)
+                if x < 7:
+                    t[:, y + 1, x + 1] += error * (1 / 16)
+    return ink.reshape(-1, 64)
+
+def quantizeCells(cells, palette, dither=Dither.ORDERED, paletteSize=8):
+    """
+    Quantizes (cells, 64, 3) RGB pixels to the best two color attribute per cell.
+    Returns the ink mask as (cells, 64) booleans and the (paper, ink) LUT indices per cell.
+    """
+    cells = np.asarray(cells, dtype=np.float32)
+    palette = np.asarray(palette, dtype=np.float32)
+    paper, ink = _candidatePairs(paletteSize, len(palette) // paletteSize)
+
+    # Distance of every pixel to the segment between each candidate pair of colors,
+    # which measures how well the pair can reproduce the cell once dithered
+    a = palette[paper]
+    ab = palette[ink] - a
+    ap = cells[:, :, np.newaxis, :] - a
+    t = np.clip((ap * ab).sum(axis=3) / (ab * ab).sum(axis=1), 0.0, 1.0)
+    error = ((ap - t[..., np.newaxis] * ab) ** 2).sum(axis=3).sum(axis=1)
+
+    best = error.argmin(axis=1)
+    t = t[np.arange(len(cells)), :, best]
+
+    if dither == Dither.ORDERED:
+        mask = t > _BAYER
+    elif dither == Dither.DIFFUSION:
+        mask = _diffuse(t)
+    else:
+        mask = t >= 0.5
+
+    return mask, paper[best], ink[best]
+
+def _quantizeRow(strip, palette, dither, paletteSize):
+    # A strip is one row of 8 pixel high cells; split it into (cells, 64, 3)
+    cells = strip.reshape(8, -1, 8, 3).transpose(1, 0, 2, 3).reshape(-1, 64, 3)
+    return quantizeCells(cells, palette, dither, paletteSize)
+
+def quantizeImage(rgb, palette, dither=Dither.ORDERED, paletteSize=8, processes=None):
+    """
+    Quantizes a (height, width, 3) RGB image into 8x8 attribute cells.
+    palette is the RGB lookup table indexed by palette * paletteSize + color. If processes
+    is greater than one the rows of cells are spread across a process pool.
+    Returns the ink mask as (height, width) booleans and the (paper, ink) LUT indices as
+    (height / 8, width / 8) arrays.
+    """
+    rgb = np.asarray(rgb)
+    height, width = rgb.shape[0], rgb.shape[1]
+    strips = [rgb[y:y + 8] for y in range(0, height, 8)]
+    args = (palette, dither, paletteSize)
+
+    if processes and processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            rows = list(pool.map(_quantizeRow, strips, *[[arg] * len(strips) for arg in args]))
+    else:
+        rows = [_quantizeRow(strip, *args) for strip in strips]
+
+    mask = np.stack([row[0] for row in rows]).reshape(height // 8, width // 8, 8, 8)
+    mask = mask.transpose(0, 2, 1, 3).reshape(height, width)
+    paper = np.stack([row[1] for row in rows])
+    ink = np.stack([row[2] for row in rows])
+    return mask, paper, ink
@@ -0,0 +1,117 @@
+import numpy as np
+
+class RetroBuffer(object):
+    """
+    Base class of the machine buffers. A machine stores its screen however suits it and
+    describes it as a (height, width) array of palette indices; rendering, Qt display,
+    image export and the tracking of changed colour cells are shared from there.
+    """
+    WIDTH = None
+    HEIGHT = None
+    CELL_WIDTH = None
+    CELL_HEIGHT = None
+    # Width of a pixel relative to its height on the real display
+    PIXEL_ASPECT = 1
+    # RGB colours indexed by the values indexImage() returns
+    PALETTE = ()
+    NATIVE_EXTENSION = None
+
+    def __init__(self):
+        # Persistent render target, reused for every render
+        self._rgb = np.zeros((self.HEIGHT, self.WIDTH, 3), dtype=np.uint8)
+        self._pixmap = None
+        self._needsUpdate = True
+
+        # Colour cells touched since the last call to takeDirtyCells
+        self._dirtyCells = np.zeros((self.HEIGHT // self.CELL_HEIGHT, self.WIDTH // self.CELL_WIDTH), dtype=bool)
+
+    @classmethod
+    def paletteLUT(cls):
+        """
+        Returns the RGB lookup table for the values of indexImage()
+        """
+        if "_paletteLUT" not in cls.__dict__:
+            cls._paletteLUT = np.array(cls.PALETTE, dtype=np.uint8)
+        return cls._paletteLUT
+
+    def indexImage(self):
+        """
+        Returns the buffer as a (height, width) array of palette LUT indices
+        """
+        raise NotImplementedError
+
+    def saveNative(self, filename):
+        """
+        Writes the buffer in the machine's own screen format
+        """
+        raise NotImplementedError
+
+    def _update(self):
+        if self._needsUpdate:
+            np.take(self.paletteLUT(), self.indexImage(), axis=0, out=self._rgb)
+            self._pixmap = None
+            self._needsUpdate = False
+
+    @property
+    def size(self):
+        return (self.WIDTH, self.HEIGHT)
+
+    @property
+    def sizeAttr(self):
+        return (self.WIDTH // self.CELL_WIDTH, self.HEIGHT // self.CELL_HEIGHT)
+
+    @property
+    def rgb(self):
+        """
+        The rendered screen as a (height, width, 3) array; it is reused between renders
+        """
+        self._update()
+        return self._rgb
+
+    def displayRGB(self):
+        """
+        Returns the rendered screen with pixels repeated to their shape on the real display
+        """
+        rgb = self.rgb
+        if self.PIXEL_ASPECT > 1:
+            return np.repeat(rgb, int(round(self.PIXEL_ASPECT)), axis=1)
+        if self.PIXEL_ASPECT < 1:
+            return np.repeat(rgb, int(round(1 / self.PIXEL_ASPECT)), axis=0)
+        return rgb
+
+    @property
+    def qpixmap(self):
+        self._update()
+        if self._pixmap is None:
+            # Qt is only needed for display, so the adapter is imported on first use
+            from retmod.qtadapter import rgbToQPixmap
+            self._pixmap = rgbToQPixmap(self._rgb)
+        return self._pixmap
+
+    def saveBuffer(self, filename, format=None, scale=1):
+        """
+        Writes the screen to an image file, palettised where the format allows, with every
+        pixel repeated scale times and corrected for the machine's pixel aspect
+        """
+        from retmod.export import saveImage
+        saveImage(self, filename, scale, format)
+
+    @staticmethod
+    def inRange(x, y, width, height):
+        return 0 <= x < width and 0 <= y < height
+
+    def _markDirty(self, x, y):
+        self._dirtyCells[y, x] = True
+        self._needsUpdate = True
+
+    def _markAllDirty(self):
+        self._dirtyCells[:] = True
+        self._needsUpdate = True
+
+    def takeDirtyCells(self):
+        """
+        Returns the (x, y) colour cells touched since the last call and resets the tracking
+        """
+        cells = [(int(x), int(y)) for y, x in np.argwhere(self._dirtyCells)]
+        self._dirtyCells[:] = False
+        return cells
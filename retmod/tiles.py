@@ -0,0 +1,124 @@
+import os
+import numpy as np
+
+# Byte with its bits in reverse order, for mirroring a cell horizontally
+_REVERSE = np.array([int("{:08b}".format(i)[::-1], 2) for i in range(256)], dtype=np.uint8)
+
+FLIP_X = 0x01
+FLIP_Y = 0x02
+INVERT = 0x04
+
+class TileIndexer(object):
+    """
+    Indexes the 8x8 cells of a buffer into a set of unique character tiles. Mirrored
+    and inverted cells can optionally be folded onto the same tile, in which case the
+    map records the transform that recreates each cell from its tile.
+    The unique count is kept up to date incrementally as cells are edited.
+    """
+    def __init__(self, buffer, foldMirrors=False, foldInverse=False):
+        self._buffer = buffer
+        self._transforms = [t for t in range(8)
+                            if (foldMirrors or not t & (FLIP_X | FLIP_Y)) and (foldInverse or not t & INVERT)]
+        self._counts = dict()
+        self._keys = np.zeros((buffer.ATTR_HEIGHT, buffer.ATTR_WIDTH), dtype=np.uint64)
+        self.rebuild()
+
+    @property
+    def uniqueCount(self):
+        return len(self._counts)
+
+    def _cells(self, ys, xs):
+        """
+        Returns the (n, 8) bitmap bytes of the cells at the ys and xs cell coordinates
+        """
+        bitmap = self._buffer.bitmap.reshape(self._buffer.ATTR_HEIGHT, 8, self._buffer.ATTR_WIDTH)
+        return bitmap[ys, :, xs]
+
+    def _canonical(self, cells):
+        """
+        Returns the canonical key of each cell and the transform from that key back to the cell
+        """
+        variants = []
+        for transform in self._transforms:
+            variant = cells
+            if transform & FLIP_X:
+                variant = _REVERSE[variant]
+            if transform & FLIP_Y:
+                variant = variant[:, ::-1]
+            if transform & INVERT:
+                variant = ~variant
+            variants.append(np.ascontiguousarray(variant).view(np.uint64)[:, 0])
+        variants = np.stack(variants, axis=1)
+        best = variants.argmin(axis=1)
+        # Each transform is its own inverse, so it also maps the tile back to the cell
+        return variants[np.arange(len(cells)), best], np.array(self._transforms, dtype=np.uint8)[best]
+
+    def rebuild(self):
+        ys, xs = np.indices(self._keys.shape)
+        keys, _ = self._canonical(self._cells(ys.ravel(), xs.ravel()))
+        self._keys[:] = keys.reshape(self._keys.shape)
+        unique, counts = np.unique(keys, return_counts=True)
+        self._counts = dict(zip(unique.tolist(), counts.tolist()))
+
+    def update(self, cells):
+        """
+        Updates the unique tiles for the list of (x, y) cells that have changed
+        """
+        if not cells:
+            return
+        xs, ys = np.array(cells).T
+        keys, _ = self._canonical(self._cells(ys, xs))
+        for old in self._keys[ys, xs].tolist():
+            self._counts[old] -= 1
+            if self._counts[old] == 0:
+                del self._counts[old]
+        for new in keys.tolist():
+            self._counts[new] = self._counts.get(new, 0) + 1
+        self._keys[ys, xs] = keys
+
+    def build(self):
+        """
+        Returns the charset as (tiles, 8) bytes in order of first use, the (24, 32) tile map
+        and the (24, 32) transform flags
+        """
+        ys, xs = np.indices(self._keys.shape)
+        keys, transforms = self._canonical(self._cells(ys.ravel(), xs.ravel()))
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        charset = unique[order].view(np.uint8).reshape(-1, 8)
+        return charset, rank[inverse].reshape(self._keys.shape), transforms.reshape(self._keys.shape)
+
+    def exportBinary(self, filename):
+        """
+        Writes the charset, tile map and attributes to <base>.chr, <base>.map and <base>.atr.
+        Map entries are bytes, or 16 bit little endian if there are more than 256 tiles.
+        """
+        charset, tileMap, _ = self.build()
+        base = os.path.splitext(filename)[0]
+        charset.tofile(base + ".chr")
+        tileMap.astype(np.uint8 if len(charset) <= 256 else "<u2").tofile(base + ".map")
+        self._buffer.attributes.tofile(base + ".atr")
+
+    def exportAssembler(self, filename, label="tiles"):
+        """
+        Writes the charset, tile map, transform flags (when folding) and attributes as assembler data
+        """
+        charset, tileMap, transforms = self.build()
+        directive = "defb" if len(charset) <= 256 else "defw"
+
+        def rows(data, directive):
+            digits = 2 if directive == "defb" else 4
+            return ["    {} {}".format(directive, ", ".join("${:0{}x}".format(value, digits) for value in row))
+                    for row in data]
+
+        lines = ["; {} unique tiles".format(len(charset)), "{}_charset:".format(label)]
+        lines += rows(charset, "defb")
+        lines += ["", "{}_map:".format(label)] + rows(tileMap, directive)
+        if len(self._transforms) > 1:
+            lines += ["", "{}_transforms:".format(label)] + rows(transforms, "defb")
+        lines += ["", "{}_attributes:".format(label)] + rows(self._buffer.attributes, "defb")
+
+        with open(filename, "w") as output:
+            output.write("\n".join(lines) + "\n")
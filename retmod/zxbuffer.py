@@ -1,20 +1,20 @@
-from PySide6 import QtGui
-from PySide6.QtGui import QColor, QPixmap
-from PySide6.QtCore import QSize, QPoint
-from PIL import Image, ImageDraw
-from PIL.ImageQt import ImageQt
+import os
+from enum import Enum
 import numpy as np
 
-from retmod.bresenham import BresenhamLine
+from retmod.retrobuffer import RetroBuffer
+from retmod.bresenham import polylinePoints, rectPoints, ellipsePoints
+from retmod.quantizer import Dither, quantizeImage
 
 class ZXAttribute(object):
     """
     Defines the state of a ZX Spectrum attribute
     """
-    def __init__(self, ink=0, paper=0, palette=0):
+    def __init__(self, ink=0, paper=0, palette=0, flash=False):
         self._ink = ink
         self._paper = paper
         self._palette = palette
+        self._flash = flash
 
     @staticmethod
     def paletteCount():
@@ -55,6 +55,29 @@ class ZXAttribute(object):
             raise IndexError("Index palette {} is out of bounds (palette count {})".
                              format(indexPalette, ZXAttribute.paletteCount()))
 
+    @staticmethod
+    def packByte(ink, paper, palette, flash=False):
+        """
+        Packs the attribute into a Spectrum attribute byte (FLASH, BRIGHT, PAPER, INK)
+        """
+        ZXAttribute._validatePaletteColor(ink, palette)
+        ZXAttribute._validatePaletteColor(paper, palette)
+        return (int(bool(flash)) << 7) | (palette << 6) | (paper << 3) | ink
+
+    @staticmethod
+    def unpackByte(value):
+        """
+        Unpacks a Spectrum attribute byte (or array of bytes) into ink, paper and palette
+        """
+        return value & 0x07, (value >> 3) & 0x07, (value >> 6) & 0x01
+
+    @staticmethod
+    def unpackFlash(value):
+        """
+        Returns the FLASH bit of a Spectrum attribute byte (or array of bytes)
+        """
+        return (value >> 7) & 0x01
+
     @property
     def ink(self):
         return self._ink
@@ -81,6 +104,14 @@ class ZXAttribute(object):
     def palette(self, value):
         ZXAttribute._validatePaletteColor(self._ink, value)
         self._palette = value
+
+    @property
+    def flash(self):
+        return self._flash
+
+    @flash.setter
+    def flash(self, value):
+        self._flash = bool(value)
         
     def encodeToJSON(self):
         rdict = dict()
@@ -88,6 +119,7 @@ class ZXAttribute(object):
         rdict["ink"] = self._ink
         rdict["paper"] = self._paper
         rdict["palette"] = self._palette
+        rdict["flash"] = self._flash
         
         return rdict
 
@@ -95,154 +127,573 @@ class ZXAttribute(object):
         self._ink = json["ink"]
         self._paper = json["paper"]
         self._palette = json["palette"]
-        if self._paper < 7:
-            print(self._paper)
+        self._flash = json.get("flash", False)
+
+    def encodeToByte(self):
+        return ZXAttribute.packByte(self._ink, self._paper, self._palette, self._flash)
+
+    def decodeFromByte(self, value):
+        self._ink, self._paper, self._palette = (int(v) for v in ZXAttribute.unpackByte(value))
+        self._flash = bool(ZXAttribute.unpackFlash(value))
+
+class BlitOp(Enum):
+    OR = 1
+    AND = 2
+    XOR = 3
+    REPLACE = 4
+
+class ZXBrush(object):
+    """
+    A rectangular block of bitmap and attributes copied from a buffer. The bitmap is
+    packed 8 pixels per byte from the left edge of the block, and there is one attribute
+    for each 8x8 block of pixels from the top left corner.
+    """
+    def __init__(self, bitmap, attributes, width, height):
+        self._bitmap = bitmap
+        self._attributes = attributes
+        self._width = width
+        self._height = height
+
+    @property
+    def bitmap(self):
+        return self._bitmap
 
-class ZXSpectrumBuffer(object):
+    @property
+    def attributes(self):
+        return self._attributes
+
+    @property
+    def size(self):
+        return (self._width, self._height)
+
+    def coverage(self):
+        """
+        Returns the packed bits the brush covers, which are all of them bar the unused
+        low bits at the end of each row
+        """
+        cover = np.full(self._bitmap.shape, 0xff, dtype=np.uint8)
+        if self._width & 0x07:
+            cover[:, -1] = (0xff00 >> (self._width & 0x07)) & 0xff
+        return cover
+
+class ZXSpectrumBuffer(RetroBuffer):
     """
     This class defines a buffer for the ZX Spectrum.
+
+    The buffer is held as a 6912 byte array in the native .SCR layout: a packed
+    bitmap of 8 pixels per byte (most significant bit is the leftmost pixel) with
+    rows interleaved by third, character row and pixel line, followed by one
+    attribute byte per 8x8 cell in the Spectrum FLASH/BRIGHT/PAPER/INK layout.
     """
+    WIDTH = 256
+    HEIGHT = 192
+    CELL_WIDTH = 8
+    CELL_HEIGHT = 8
+    ATTR_WIDTH = 32
+    ATTR_HEIGHT = 24
+    SCR_SIZE = 6912
+    NATIVE_EXTENSION = ".scr"
+    # Indexed by palette * 8 + color, so the normal colours come before the bright ones
+    PALETTE = tuple(ZXAttribute.getPaletteColor(index, palette)
+                    for palette in range(ZXAttribute.paletteCount())
+                    for index in range(ZXAttribute.paletteSize()))
+
     def __init__(self, fgIndex=0, bgIndex=7, paletteIndex=0):
-        self._paper = Image.new("RGB", self.size.toTuple())
-        self._ink = Image.new("RGB", self.size.toTuple())
-        self._mask = Image.new("1", self.size.toTuple())
-        self._final = None
-        self._needsUpdate = True
+        super(ZXSpectrumBuffer, self).__init__()
+        self._attachScreen(np.zeros(ZXSpectrumBuffer.SCR_SIZE, dtype=np.uint8))
 
-        # Set up attribute colors
-        self._attributes = dict()
-        for y in range(0, self.sizeAttr.height()):
-            for x in range(0, self.sizeAttr.width()):
-                self._attributes[(x, y)] = ZXAttribute()
+        # Second FLASH phase and the screen it was rendered from; after a change only the
+        # cells that differ from that screen are rendered again
+        self._flashRGB = None
+        self._flashScreen = None
+        self._flashPixmap = None
+        self._flashPixmapStale = np.zeros((self.ATTR_HEIGHT, self.ATTR_WIDTH), dtype=bool)
 
         self.clear(fgIndex, bgIndex, paletteIndex)
-        
-    def _update(self):
-        if self._needsUpdate:
-            self._final = ImageQt(Image.composite(self._ink, self._paper, self._mask))
-            self._needsUpdate = False
 
-    @property
-    def size(self):
-        return QSize(256, 192)
+    def _attachScreen(self, screen):
+        self._screen = screen
+        # The .SCR bitmap is ordered [third, line, row, byte]; swapping line and row gives a
+        # view indexed like a linear (192, 32) bitmap reshaped to (3, 8, 8, 32)
+        self._bitmap = screen[:6144].reshape(3, 8, 8, 32).transpose(0, 2, 1, 3)
+        self._attrs = screen[6144:].reshape(self.ATTR_HEIGHT, self.ATTR_WIDTH)
+
+    @staticmethod
+    def _bitmapRow(y):
+        return (y >> 6, (y >> 3) & 0x07, y & 0x07)
+
+    def indexImage(self):
+        """
+        Returns the buffer as a (192, 256) array of palette LUT indices
+        """
+        ink, paper, palette = ZXAttribute.unpackByte(self._attrs)
+        ink = (ink | (palette << 3))[:, np.newaxis, :, np.newaxis]
+        paper = (paper | (palette << 3))[:, np.newaxis, :, np.newaxis]
+        mask = np.unpackbits(self.bitmap, axis=1).reshape(self.ATTR_HEIGHT, 8, self.ATTR_WIDTH, 8)
+        return np.where(mask, ink, paper).reshape(self.HEIGHT, self.WIDTH)
 
     @property
-    def sizeAttr(self):
-        return QSize(32, 24)
-    
+    def hasFlash(self):
+        return bool(ZXAttribute.unpackFlash(self._attrs).any())
+
+    def flashCells(self):
+        """
+        Returns the ys and xs arrays of the cells with FLASH set
+        """
+        return np.nonzero(ZXAttribute.unpackFlash(self._attrs))
+
     @property
-    def qpixmap(self):
+    def flashRGB(self):
+        """
+        The rendered screen in the second FLASH phase, with ink and paper swapped in the
+        flashing cells. Only those cells are rendered, over a copy of the first phase.
+        """
         self._update()
-        return QtGui.QPixmap.fromImage(self._final)
-    
+        if self._flashRGB is None:
+            self._flashRGB = self._rgb.copy()
+            self._flashScreen = self._screen.copy()
+            changed = ZXAttribute.unpackFlash(self._attrs).astype(bool)
+        else:
+            # Cells differ if any of their bitmap bytes, ordered [third, line, row, byte], or
+            # their attribute differ
+            changed = (self._screen != self._flashScreen)
+            if not changed.any():
+                return self._flashRGB
+            changed = changed[:6144].reshape(3, 8, 8, 32).any(axis=1).reshape(self.ATTR_HEIGHT, self.ATTR_WIDTH) | \
+                changed[6144:].reshape(self.ATTR_HEIGHT, self.ATTR_WIDTH)
+            self._flashScreen[:] = self._screen
+            self._flashPixmapStale |= changed
+
+        # Changed cells start from the first phase and only flashing ones are swapped
+        cells = self._flashRGB.reshape(self.ATTR_HEIGHT, 8, self.ATTR_WIDTH, 8, 3)
+        ys, xs = np.nonzero(changed)
+        cells[ys, :, xs] = self._rgb.reshape(cells.shape)[ys, :, xs]
+        flash = ZXAttribute.unpackFlash(self._attrs[ys, xs]).astype(bool)
+        ys, xs = ys[flash], xs[flash]
+        if len(xs):
+            ink, paper, palette = ZXAttribute.unpackByte(self._attrs[ys, xs])
+            ink = (ink | (palette << 3))[:, np.newaxis, np.newaxis]
+            paper = (paper | (palette << 3))[:, np.newaxis, np.newaxis]
+            mask = np.unpackbits(self.getCells(xs, ys), axis=1).reshape(-1, 8, 8)
+            cells[ys, :, xs] = ZXSpectrumBuffer.paletteLUT()[np.where(mask, paper, ink)]
+        return self._flashRGB
+
+    @property
+    def flashQPixmap(self):
+        """
+        The second FLASH phase as a QPixmap, into which only changed cells are redrawn
+        """
+        if not self.hasFlash:
+            return self.qpixmap
+        rgb = self.flashRGB
+        from retmod.qtadapter import rgbToQPixmap, drawRGB
+        if self._flashPixmap is None:
+            self._flashPixmap = rgbToQPixmap(rgb)
+        elif self._flashPixmapStale.any():
+            ys, xs = np.nonzero(self._flashPixmapStale)
+            top, bottom = ys.min() * 8, (ys.max() + 1) * 8
+            left, right = xs.min() * 8, (xs.max() + 1) * 8
+            drawRGB(self._flashPixmap, left, top, rgb[top:bottom, left:right])
+        self._flashPixmapStale[:] = False
+        return self._flashPixmap
+
+    @property
+    def bitmap(self):
+        """
+        Packed bitmap as a linear (192, 32) array of bytes (a copy)
+        """
+        return self._bitmap.reshape(self.HEIGHT, self.WIDTH // 8)
+
+    @property
+    def screen(self):
+        """
+        The whole buffer as a 6912 byte array in .SCR layout
+        """
+        return self._screen
+
+    def setScreen(self, data):
+        """
+        Replaces the whole buffer from 6912 bytes in .SCR layout
+        """
+        data = np.frombuffer(data, dtype=np.uint8)
+        if data.size != ZXSpectrumBuffer.SCR_SIZE:
+            raise ValueError("Screen data is {} bytes rather than {}".format(data.size, ZXSpectrumBuffer.SCR_SIZE))
+        self._screen[:] = data
+        self._markAllDirty()
+
+    def setContents(self, bitmap, attributes):
+        """
+        Replaces the screen from a linear (192, 32) packed bitmap and (24, 32) attributes,
+        marking only the cells that change
+        """
+        bitmap = np.asarray(bitmap, dtype=np.uint8).reshape(self._bitmap.shape)
+        attributes = np.asarray(attributes, dtype=np.uint8).reshape(self._attrs.shape)
+
+        changed = (bitmap != self._bitmap).transpose(0, 1, 3, 2).reshape(self.ATTR_HEIGHT, self.ATTR_WIDTH, 8)
+        changed = changed.any(axis=2) | (attributes != self._attrs)
+        self._bitmap[:] = bitmap
+        self._attrs[:] = attributes
+        if changed.any():
+            self._dirtyCells |= changed
+            self._needsUpdate = True
+
     @staticmethod
-    def inRange(point, range):
-        if point.x() >= 0 and point.x() < range.width() and \
-            point.y() >= 0 and point.y() < range.height():
-            return True
-        return False
-
-    def clear(self, fgIndex, bgIndex, paletteIndex=0):
-        for y in range(0, self.sizeAttr.height()):
-            for x in range(0, self.sizeAttr.width()):
-                self._attributes[(x, y)].ink = fgIndex
-                self._attributes[(x, y)].paper = bgIndex
-                self._attributes[(x, y)].palette = paletteIndex
-        
-        im_ink = ImageDraw.Draw(self._ink)
-        im_ink.rectangle([0, 0, self.size.width() - 1, self.size.height() - 1],
-                         fill=ZXAttribute.getPaletteColor(fgIndex, paletteIndex))
+    def _rowOffsets(y):
+        """
+        Returns the .SCR byte offsets of the start of the bitmap rows y
+        """
+        return ((y & 0xc0) << 5) | ((y & 0x07) << 8) | ((y & 0x38) << 2)
 
-        im_paper = ImageDraw.Draw(self._paper)
-        im_paper.rectangle([0, 0, self.size.width() - 1, self.size.height() - 1],
-                           fill=ZXAttribute.getPaletteColor(bgIndex, paletteIndex))
+    @staticmethod
+    def _shiftRight(rows, shift):
+        """
+        Shifts packed rows right by 1 to 7 pixels, adding a byte to each row
+        """
+        wide = rows.astype(np.uint16) << (8 - shift)
+        shifted = np.zeros((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        shifted[:, :-1] = wide >> 8
+        shifted[:, 1:] |= (wide & 0xff).astype(np.uint8)
+        return shifted
+
+    def copyRegion(self, x, y, width, height):
+        """
+        Returns a brush holding the region at x, y of width by height pixels clipped to
+        the screen, or None if that is empty. Regions starting on a byte boundary are
+        copied without shifting.
+        """
+        x1 = max(int(x), 0)
+        y1 = max(int(y), 0)
+        x2 = min(int(x) + int(width), self.WIDTH)
+        y2 = min(int(y) + int(height), self.HEIGHT)
+        if x2 <= x1 or y2 <= y1:
+            return None
+
+        shift = x1 & 0x07
+        columns = np.arange(x1 >> 3, ((x2 - 1) >> 3) + 1)
+        rows = self._screen[self._rowOffsets(np.arange(y1, y2))[:, np.newaxis] + columns]
+        if shift:
+            # Shift left by reading each byte together with the one after it
+            wide = np.zeros((rows.shape[0], rows.shape[1] + 1), dtype=np.uint16)
+            wide[:, :-1] = rows
+            rows = (((wide[:, :-1] << 8) | wide[:, 1:]) >> (8 - shift)).astype(np.uint8)
+        rows = rows[:, :(x2 - x1 + 7) >> 3]
+
+        cellYs = np.arange(y1, y2, 8)[:, np.newaxis] >> 3
+        cellXs = np.arange(x1, x2, 8) >> 3
+        brush = ZXBrush(rows, self._attrs[cellYs, cellXs], x2 - x1, y2 - y1)
+        brush.bitmap[:] &= brush.coverage()
+        return brush
+
+    def stamp(self, brush, x, y, op=BlitOp.REPLACE, attributes=True):
+        """
+        Blits the brush with its top left corner at x, y, combining its bitmap with the
+        screen by op and, if attributes is set, copying its attributes to every cell it
+        touches. Brushes placed on a byte boundary are written without shifting.
+        """
+        x = int(x)
+        y = int(y)
+        width, height = brush.size
+
+        bitmap = brush.bitmap
+        cover = brush.coverage()
+        if x & 0x07:
+            bitmap = self._shiftRight(bitmap, x & 0x07)
+            cover = self._shiftRight(cover, x & 0x07)
+
+        columns = (x >> 3) + np.arange(bitmap.shape[1])
+        rows = y + np.arange(height)
+        keepColumns = (columns >= 0) & (columns < self.ATTR_WIDTH)
+        keepRows = (rows >= 0) & (rows < self.HEIGHT)
+        if not keepColumns.any() or not keepRows.any():
+            return
 
-        im_mask = ImageDraw.Draw(self._mask)
-        im_mask.rectangle([0, 0, self.size.width() - 1, self.size.height() - 1],
-                          fill=0)
+        bitmap = bitmap[keepRows][:, keepColumns]
+        cover = cover[keepRows][:, keepColumns]
+        offsets = self._rowOffsets(rows[keepRows])[:, np.newaxis] + columns[keepColumns]
+        screen = self._screen[offsets]
+        if op == BlitOp.OR:
+            screen |= bitmap
+        elif op == BlitOp.AND:
+            screen &= bitmap | ~cover
+        elif op == BlitOp.XOR:
+            screen ^= bitmap
+        else:
+            screen = (screen & ~cover) | bitmap
+        self._screen[offsets] = screen
+
+        # Each cell takes the attribute of the brush cell over its top left covered pixel
+        cellXs = np.arange(max(x, 0) >> 3, ((min(x + width, self.WIDTH) - 1) >> 3) + 1)
+        cellYs = np.arange(max(y, 0) >> 3, ((min(y + height, self.HEIGHT) - 1) >> 3) + 1)[:, np.newaxis]
+        if attributes:
+            brushXs = np.maximum(cellXs * 8 - x, 0) >> 3
+            brushYs = np.maximum(cellYs * 8 - y, 0) >> 3
+            self._attrs[cellYs, cellXs] = brush.attributes[brushYs, brushXs]
+        self._dirtyCells[cellYs, cellXs] = True
+        self._needsUpdate = True
 
+    def getCells(self, xs, ys):
+        """
+        Returns the (n, 8) bitmap bytes of the cells at the xs and ys cell coordinate arrays
+        """
+        offsets = self._rowOffsets(np.asarray(ys)[:, np.newaxis] * 8 + np.arange(8)) + np.asarray(xs)[:, np.newaxis]
+        return self._screen[offsets]
+
+    def setCells(self, xs, ys, cells, attributes):
+        """
+        Writes the (n, 8) bitmap bytes and attributes of the cells at the xs and ys cell
+        coordinate arrays and marks them
+        """
+        offsets = self._rowOffsets(np.asarray(ys)[:, np.newaxis] * 8 + np.arange(8)) + np.asarray(xs)[:, np.newaxis]
+        self._screen[offsets] = cells
+        self._attrs[ys, xs] = attributes
+        self._dirtyCells[ys, xs] = True
         self._needsUpdate = True
 
-    def setAttr(self, x, y, fgIndex, bgIndex, paletteIndex):
-        x = x // 8
-        y = y // 8
-        pos = (x * 8, y * 8)
+    def writeScreenBytes(self, offsets, values):
+        """
+        Writes values to the given .SCR layout byte offsets and marks the cells they cover
+        """
+        offsets = np.asarray(offsets, dtype=np.intp)
+        self._screen[offsets] = values
+
+        bitmap = offsets[offsets < 6144]
+        attrs = offsets[offsets >= 6144] - 6144
+        self._dirtyCells[((bitmap >> 11) << 3) | ((bitmap >> 5) & 0x07), bitmap & 0x1f] = True
+        self._dirtyCells[attrs >> 5, attrs & 0x1f] = True
+        self._needsUpdate = True
 
-        if not ZXSpectrumBuffer.inRange(QPoint(x, y), self.sizeAttr):
+    @property
+    def attributes(self):
+        """
+        Attribute bytes as a (24, 32) array
+        """
+        return self._attrs
+
+    def clear(self, fgIndex, bgIndex, paletteIndex=0, flash=False):
+        self._attrs[:] = ZXAttribute.packByte(fgIndex, bgIndex, paletteIndex, flash)
+        self._bitmap[:] = 0
+        self._markAllDirty()
+
+    def getAttr(self, x, y):
+        """
+        Returns the attribute covering the pixel x, y
+        """
+        attr = ZXAttribute()
+        attr.decodeFromByte(self._attrs[int(y) // 8, int(x) // 8])
+        return attr
+
+    def setAttr(self, x, y, fgIndex, bgIndex, paletteIndex, flash=False):
+        x = int(x) // 8
+        y = int(y) // 8
+
+        if not ZXSpectrumBuffer.inRange(x, y, self.ATTR_WIDTH, self.ATTR_HEIGHT):
             return
 
-        attr = self._attributes[(x, y)]
+        value = ZXAttribute.packByte(fgIndex, bgIndex, paletteIndex, flash)
+        if self._attrs[y, x] != value:
+            self._attrs[y, x] = value
+            self._markDirty(x, y)
 
-        paletteChanged = False
-        if attr.palette != paletteIndex:
-            paletteChanged = True
-            attr.palette = paletteIndex
+    def setPixel(self, x, y, fgIndex, bgIndex, paletteIndex, flash=False):
+        x = int(x)
+        y = int(y)
 
-        if attr.ink != fgIndex or paletteChanged:
-            attr.ink = fgIndex
-            im_ink = ImageDraw.Draw(self._ink)
-            im_ink.rectangle([pos[0], pos[1], pos[0]+7, pos[1]+7],
-                             fill=ZXAttribute.getPaletteColor(fgIndex, paletteIndex))
-            self._needsUpdate = True
+        if not ZXSpectrumBuffer.inRange(x, y, self.WIDTH, self.HEIGHT):
+            return
+        
+        self.setAttr(x, y, fgIndex, bgIndex, paletteIndex, flash=flash)
+        self._bitmap[ZXSpectrumBuffer._bitmapRow(y) + (x >> 3,)] |= 0x80 >> (x & 7)
+        self._markDirty(x >> 3, y >> 3)
 
-        if attr.paper != bgIndex or paletteChanged:
-            attr.paper = bgIndex
-            im_paper = ImageDraw.Draw(self._paper)
-            im_paper.rectangle([pos[0], pos[1], pos[0]+7, pos[1]+7],
-                               fill=ZXAttribute.getPaletteColor(bgIndex, paletteIndex))
-            self._needsUpdate = True
+    def erasePixel(self, x, y, fgIndex, bgIndex, paletteIndex, flash=False):
+        x = int(x)
+        y = int(y)
 
-    def setPixel(self, x, y, fgIndex, bgIndex, paletteIndex):
-        
-        if not ZXSpectrumBuffer.inRange(QPoint(x, y), self.size):
+        if not ZXSpectrumBuffer.inRange(x, y, self.WIDTH, self.HEIGHT):
             return
+
+        self.setAttr(x, y, fgIndex, bgIndex, paletteIndex, flash=flash)
+        self._bitmap[ZXSpectrumBuffer._bitmapRow(y) + (x >> 3,)] &= ~(0x80 >> (x & 7)) & 0xff
+        self._markDirty(x >> 3, y >> 3)
         
-        self.setAttr(x, y, fgIndex, bgIndex, paletteIndex)
-        self._mask.putpixel((int(x), int(y)), 1)
-        self._needsUpdate = True
+    def drawLine(self, x1, y1, x2, y2, fgIndex, bgIndex, paletteIndex, flash=False):
+        self.drawPolyline(((x1, y1), (x2, y2)), fgIndex, bgIndex, paletteIndex, flash=flash)
+
+    def drawPolyline(self, points, fgIndex, bgIndex, paletteIndex, flash=False):
+        """
+        Draws connected line segments through the points, clipped to the screen, setting
+        the bitmap and the attributes of the cells it passes through in one batch
+        """
+        x, y = polylinePoints(points)
+        self.setPixels(x, y, fgIndex, bgIndex, paletteIndex, flash=flash)
+
+    def drawRect(self, x1, y1, x2, y2, fgIndex, bgIndex, paletteIndex, filled=False, flash=False):
+        x, y = rectPoints((x1, y1), (x2, y2), filled, (self.WIDTH, self.HEIGHT))
+        self.setPixels(x, y, fgIndex, bgIndex, paletteIndex, flash=flash)
+
+    def drawEllipse(self, x1, y1, x2, y2, fgIndex, bgIndex, paletteIndex, filled=False, flash=False):
+        """
+        Draws the ellipse inscribed in the box with corners x1, y1 and x2, y2
+        """
+        x, y = ellipsePoints((x1, y1), (x2, y2), filled, (self.WIDTH, self.HEIGHT))
+        self.setPixels(x, y, fgIndex, bgIndex, paletteIndex, flash=flash)
+
+    def setPixels(self, x, y, fgIndex, bgIndex, paletteIndex, flash=False):
+        """
+        Sets all the pixels at the x and y integer arrays, ignoring any off screen
+        """
+        value = ZXAttribute.packByte(fgIndex, bgIndex, paletteIndex, flash)
+        inside = (x >= 0) & (x < self.WIDTH) & (y >= 0) & (y < self.HEIGHT)
+        x = x[inside]
+        y = y[inside]
+        if x.size == 0:
+            return
 
-    def erasePixel(self, x, y, fgIndex, bgIndex, paletteIndex):
-        self.setAttr(x, y, fgIndex, bgIndex, paletteIndex)
-        self._mask.putpixel((int(x), int(y)), 0)
+        if x.size > self.WIDTH:
+            # Large batches such as filled shapes are cheaper to pack as a whole mask
+            mask = np.zeros((self.HEIGHT, self.WIDTH), dtype=bool)
+            mask[y, x] = True
+            self._bitmap |= np.packbits(mask, axis=1).reshape(self._bitmap.shape)
+        else:
+            np.bitwise_or.at(self._bitmap, (y >> 6, (y >> 3) & 0x07, y & 0x07, x >> 3),
+                             (0x80 >> (x & 0x07)).astype(np.uint8))
+
+        cells = np.unique((y >> 3) * self.ATTR_WIDTH + (x >> 3))
+        self._attrs.flat[cells] = value
+        self._dirtyCells.flat[cells] = True
         self._needsUpdate = True
-        
-    def drawLine(self, x1, y1, x2, y2, fgIndex, bgIndex, paletteIndex):
-        for x, y in BresenhamLine((x1, y1), (x2, y2)):
-            self.setAttr(x, y, fgIndex, bgIndex, paletteIndex)
-            pos = QPoint(int(x), int(y))
-            if ZXSpectrumBuffer.inRange(pos, self.size):
-                self._mask.putpixel(pos.toTuple(), 1)
+
+    def floodFill(self, x, y, fgIndex, bgIndex, paletteIndex, flash=False):
+        """
+        Fills the 4-connected area of paper (or ink) pixels around x, y with ink and sets
+        the attribute of every cell the area touches. The fill walks runs of equal pixels
+        along each line rather than single pixels, so an open screen is one run per line.
+        """
+        x = int(x)
+        y = int(y)
+
+        if not ZXSpectrumBuffer.inRange(x, y, self.WIDTH, self.HEIGHT):
+            return
+
+        mask = np.unpackbits(self.bitmap, axis=1).astype(bool)
+        starts = np.ones(mask.shape, dtype=bool)
+        starts[:, 1:] = mask[:, 1:] != mask[:, :-1]
+        runIds = np.cumsum(starts.ravel()).reshape(mask.shape) - 1
+        runStarts = np.flatnonzero(starts.ravel())
+        runEnds = np.append(runStarts[1:], mask.size) - 1
+
+        ids = runIds.ravel().tolist()
+        values = mask.ravel()[runStarts].tolist()
+        rows = (runStarts // self.WIDTH).tolist()
+        firsts = (runStarts % self.WIDTH).tolist()
+        lasts = (runEnds % self.WIDTH).tolist()
+
+        # Run ids increase along a line, so the runs of a neighbouring line that overlap
+        # a run are the id range between those under its first and last pixels
+        seed = ids[y * self.WIDTH + x]
+        target = values[seed]
+        filled = bytearray(len(values))
+        filled[seed] = 1
+        stack = [seed]
+        while stack:
+            run = stack.pop()
+            for line in (rows[run] - 1, rows[run] + 1):
+                if 0 <= line < self.HEIGHT:
+                    base = line * self.WIDTH
+                    for neighbour in range(ids[base + firsts[run]], ids[base + lasts[run]] + 1):
+                        if not filled[neighbour] and values[neighbour] == target:
+                            filled[neighbour] = 1
+                            stack.append(neighbour)
+
+        area = np.frombuffer(filled, dtype=bool)[runIds]
+        if not target:
+            self._bitmap[:] = np.packbits(mask | area, axis=1).reshape(self._bitmap.shape)
+
+        cells = area.reshape(self.ATTR_HEIGHT, 8, self.ATTR_WIDTH, 8).any(axis=(1, 3))
+        self._attrs[cells] = ZXAttribute.packByte(fgIndex, bgIndex, paletteIndex, flash)
+        self._dirtyCells |= cells
         self._needsUpdate = True
-        
-    def saveBuffer(self, filename, format=None):
-        self._update()
-        self._final.save(filename, format)
-        
+
+    def importBitmap(self, pixels, fgIndex, bgIndex, paletteIndex=0, threshold=128, flash=False):
+        """
+        Replaces the whole screen from a (192, 256) mono or greyscale array in one pass.
+        Boolean arrays are used as is (True is ink); otherwise values darker than the
+        threshold become ink.
+        """
+        pixels = np.asarray(pixels)
+        if pixels.shape != (self.HEIGHT, self.WIDTH):
+            raise ValueError("Bitmap shape {} does not match the screen size {}x{}".
+                             format(pixels.shape, self.WIDTH, self.HEIGHT))
+
+        ink = pixels if pixels.dtype == bool else pixels < threshold
+        self._bitmap[:] = np.packbits(ink, axis=1).reshape(self._bitmap.shape)
+        self._attrs[:] = ZXAttribute.packByte(fgIndex, bgIndex, paletteIndex, flash)
+        self._markAllDirty()
+
+    def importImage(self, rgb, dither=Dither.ORDERED, processes=None):
+        """
+        Replaces the whole screen from a (192, 256, 3) RGB array, choosing the best
+        ink, paper and brightness for each cell and dithering between them
+        """
+        rgb = np.asarray(rgb)
+        if rgb.shape != (self.HEIGHT, self.WIDTH, 3):
+            raise ValueError("Image shape {} does not match the screen size {}x{}".
+                             format(rgb.shape, self.WIDTH, self.HEIGHT))
+
+        size = ZXAttribute.paletteSize()
+        mask, paper, ink = quantizeImage(rgb, ZXSpectrumBuffer.paletteLUT(), dither, size, processes)
+        self._bitmap[:] = np.packbits(mask, axis=1).reshape(self._bitmap.shape)
+        self._attrs[:] = ((ink // size) << 6) | ((paper % size) << 3) | (ink % size)
+        self._markAllDirty()
+
     def encodeToJSON(self):
         rdict = dict()
-        rdict["mask"] = np.array(self._mask, dtype='uint8').tolist()
+        rdict["mask"] = np.unpackbits(self.bitmap, axis=1).tolist()
 
-        for y in range(0, self.sizeAttr.height()):
-            for x in range(0, self.sizeAttr.width()):
+        for y in range(0, self.ATTR_HEIGHT):
+            for x in range(0, self.ATTR_WIDTH):
                 key = "{},{}".format(x, y)
-                rdict[key] = self._attributes[(x, y)].encodeToJSON()
+                rdict[key] = self.getAttr(x * 8, y * 8).encodeToJSON()
 
         return rdict
     
     def decodeFromJSON(self, json):
-        # Load image as B&W image first and then convert to bitmask
-        # There may be a solution to create the 1-bit pixmap directly but this can be looked at later
-        image_data = np.array(json["mask"], dtype='uint8') * 255
-        image = Image.fromarray(image_data, mode="L")
-        self._mask = image.convert("1")
-        
-        for y in range(0, self.sizeAttr.height()):
-            for x in range(0, self.sizeAttr.width()):
-                # As we need to update the image with the attribute, go via setAttr rather than
-                # directly updating the screen attributes
+        mask = np.array(json["mask"], dtype=np.uint8) != 0
+        self._bitmap[:] = np.packbits(mask, axis=1).reshape(self._bitmap.shape)
+
+        for y in range(0, self.ATTR_HEIGHT):
+            for x in range(0, self.ATTR_WIDTH):
                 attr = ZXAttribute()
                 attr.decodeFromJSON(json["{},{}".format(x, y)])
-                self.setAttr(x * 8, y * 8, attr.ink, attr.paper, attr.palette)
+                self._attrs[y, x] = attr.encodeToByte()
         
-        self._needsUpdate = True
-                
+        self._markAllDirty()
+
+    def saveSCR(self, filename):
+        """
+        Writes the buffer as a native 6912 byte .SCR file
+        """
+        # Take the bytes before opening the file, which may be the one this buffer is mapped from
+        data = self._screen.tobytes()
+        with open(filename, "wb") as output:
+            output.write(data)
+
+    def saveNative(self, filename):
+        self.saveSCR(filename)
+
+    def loadSCR(self, filename, mmap=False):
+        """
+        Reads a native 6912 byte .SCR file. With mmap the file is memory mapped copy-on-write
+        and used directly as the buffer's backing store rather than being read in. Pages not
+        yet written still read the file, so a mapped buffer is only for read-only or batch use
+        and must not outlive changes to its file.
+        """
+        if os.path.getsize(filename) != ZXSpectrumBuffer.SCR_SIZE:
+            raise ValueError("{} is not a {} byte .SCR file".format(filename, ZXSpectrumBuffer.SCR_SIZE))
+
+        if mmap:
+            self._attachScreen(np.memmap(filename, dtype=np.uint8, mode="c",
+                                         shape=(ZXSpectrumBuffer.SCR_SIZE,)))
+        else:
+            self._screen[:] = np.fromfile(filename, dtype=np.uint8)
+        self._markAllDirty()
@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 
 import sys
-import json
+import math
 from enum import Enum
 from PySide6.QtWidgets import QApplication, QDialog, QLineEdit, QPushButton, QVBoxLayout, QWidget, QHBoxLayout, \
-    QLabel, QCheckBox, QButtonGroup, QGroupBox, QFileDialog, QSlider, QRadioButton
-from PySide6.QtGui import QIcon, QPainter, QBrush, QPen, QColor, QFont, QImage, QPixmap, QCursor
-from PySide6.QtCore import QSize, QRect, QPoint, Qt, Slot
-from retmod.zxbuffer import ZXSpectrumBuffer, ZXAttribute
+    QLabel, QCheckBox, QButtonGroup, QGroupBox, QFileDialog, QSlider, QRadioButton, QComboBox, QSpinBox, QSizePolicy
+from PySide6.QtGui import QIcon, QPainter, QBrush, QPen, QColor, QFont, QImage, QPixmap, QCursor, \
+    QShortcut, QKeySequence, QGuiApplication, QImageReader
+from PySide6.QtCore import QSize, QRect, QRectF, QPoint, QPointF, QLine, Qt, Slot, Signal, QTimer, QObject, QRunnable, \
+    QThreadPool
+from retmod.zxbuffer import ZXSpectrumBuffer, ZXAttribute, BlitOp
+from retmod.qtadapter import qimageToArray, qimageToRGB
+from retmod.quantizer import Dither
+from retmod.project import saveProject, loadProject
+from retmod.layers import LayerStack
+from retmod.animation import FrameSequence
+from retmod.export import saveAnimation
+from retmod.tiles import TileIndexer
 from retmod.palette import PaletteSelectorLayout
 
 class DrawingMode(Enum):
@@ -17,63 +26,228 @@ class DrawingMode(Enum):
     LINE = 4
     ATTR = 5
     GUIDE = 6
+    FILL = 7
+    RECT = 8
+    ELLIPSE = 9
+    CIRCLE = 10
+    SELECT = 11
+    STAMP = 12
 
 class MouseButton(Enum):
     NONE = 0,
     LEFT = 1,
-    RIGHT = 2
+    RIGHT = 2,
+    MIDDLE = 3
+
+class Viewport(object):
+    """
+    Maps between widget coordinates and canvas pixels for a zoom scale and pan offset
+    """
+    MIN_SCALE = 1
+    MAX_SCALE = 16
+
+    def __init__(self, canvasSize, scale):
+        self.canvasSize = canvasSize
+        self.scale = scale
+        # Widget position of the canvas origin
+        self.offset = QPoint(0, 0)
+
+    @property
+    def screenRect(self):
+        return self.canvasToWidget(QRect(QPoint(0, 0), self.canvasSize))
+
+    def toCanvas(self, pos):
+        return ((pos.x() - self.offset.x()) // self.scale, (pos.y() - self.offset.y()) // self.scale)
+
+    def toWidget(self, pos):
+        return QPointF((pos[0] + 0.5) * self.scale + self.offset.x(), (pos[1] + 0.5) * self.scale + self.offset.y())
+
+    def canvasToWidget(self, rect):
+        return QRect(rect.topLeft() * self.scale + self.offset, rect.size() * self.scale)
+
+    def widgetToCanvas(self, rect):
+        """
+        Returns the canvas pixels covering a widget rectangle, clipped to the canvas
+        """
+        topLeft = self.toCanvas(rect.topLeft())
+        bottomRight = self.toCanvas(rect.bottomRight())
+        return QRect(QPoint(int(topLeft[0]), int(topLeft[1])), QPoint(int(bottomRight[0]), int(bottomRight[1]))). \
+            intersected(QRect(QPoint(0, 0), self.canvasSize))
+
+    def zoom(self, scale, anchor):
+        """
+        Changes the scale keeping the canvas point under the anchor in place
+        """
+        scale = max(self.MIN_SCALE, min(self.MAX_SCALE, scale))
+        x = (anchor.x() - self.offset.x()) / self.scale
+        y = (anchor.y() - self.offset.y()) / self.scale
+        self.scale = scale
+        self.offset = QPoint(round(anchor.x() - x * scale), round(anchor.y() - y * scale))
+
+    def pan(self, delta):
+        self.offset += delta
+
+    def clamp(self, widgetSize):
+        """
+        Keeps the canvas covering the widget; a canvas smaller than the widget sits top left
+        """
+        def clampAxis(offset, canvas, widget):
+            if canvas <= widget:
+                return 0
+            return min(0, max(widget - canvas, offset))
+        self.offset = QPoint(clampAxis(self.offset.x(), self.canvasSize.width() * self.scale, widgetSize.width()),
+                             clampAxis(self.offset.y(), self.canvasSize.height() * self.scale, widgetSize.height()))
     
+class GuideLoaderSignals(QObject):
+    loaded = Signal(str, QImage, float)
+
+class GuideLoader(QRunnable):
+    """
+    Decodes a guide image on a worker thread, downsampling it to fit maxSize.
+    The loaded signal carries the image and how much it was shrunk by.
+    """
+    def __init__(self, filename, maxSize):
+        super(GuideLoader, self).__init__()
+        self.filename = filename
+        self.maxSize = maxSize
+        self.signals = GuideLoaderSignals()
+
+    def run(self):
+        reader = QImageReader(self.filename)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        scale = 1.0
+        if size.isValid() and max(size.width(), size.height()) > self.maxSize:
+            scaledSize = size.scaled(self.maxSize, self.maxSize, Qt.KeepAspectRatio)
+            reader.setScaledSize(scaledSize)
+            scale = size.width() / scaledSize.width()
+        self.signals.loaded.emit(self.filename, reader.read(), scale)
+
 class RetroDrawWidget(QWidget):
     """
     Defines widget for displaying and handling all retro drawing.
     """
+    # Modes that drag out a shape from the press to the release position
+    SHAPE_MODES = (DrawingMode.LINE, DrawingMode.RECT, DrawingMode.ELLIPSE, DrawingMode.CIRCLE, DrawingMode.SELECT)
+
+    zoomChanged = Signal(int)
+    frameChanged = Signal(int, int)
+    playingChanged = Signal(bool)
+    tilesChanged = Signal(int)
+    layersChanged = Signal()
+
     def __init__(self, fgIndex, bgIndex, palette, parent=None):
         super(RetroDrawWidget, self).__init__(parent)
 
-        self.canvasSize = QSize(256, 192)
+        self.canvasSize = QSize(ZXSpectrumBuffer.WIDTH, ZXSpectrumBuffer.HEIGHT)
         self.canvasCenter = QPoint(self.canvasSize.width() / 2, self.canvasSize.height() / 2)
         self.fgIndex = fgIndex
         self.bgIndex = bgIndex
         self.palette = palette
+        self.flash = False
 
-        self.scale = 4
-        self.screenSize = self.canvasSize * self.scale
-        self.screenCenter = self.canvasCenter * self.scale
+        # The guide position and zoom are stored relative to the canvas at the base scale
+        self.baseScale = 4
+        self.screenSize = self.canvasSize * self.baseScale
+        self.screenCenter = self.canvasCenter * self.baseScale
+        self.viewport = Viewport(self.canvasSize, self.baseScale)
 
-        self.grid = QImage(self.screenSize, QImage.Format_RGBA8888)
-        self.grid.fill(QColor(0, 0, 0, 0))
-        for y in range(0, self.screenSize.height()):
-            for x in range(0, self.screenSize.width(), 8 * self.scale):
-                self.grid.setPixelColor(x, y, QColor(0, 0, 0, 255))
-
-        for x in range(0, self.screenSize.width()):
-            for y in range(0, self.screenSize.height(), 8 * self.scale):
-                self.grid.setPixelColor(x, y, QColor(0, 0, 0, 255))
         self._gridEnabled = True
         self._gridOpacity = 0.2
+        self._pixelGridEnabled = False
+        # The pixel grid is only drawn once pixels are at least this many screen pixels wide
+        self._pixelGridMinScale = 8
 
         self._guideFilename = None
         self._guide = None
+        self._guideScale = 1.0
+        self._guideLoading = False
+        self._guideMaxSize = 2048
         self._guideEnabled = True
         self._guideOpacity = 0.2
-        self._guideCoords = QPoint(0, 0)
+        self._guideCoords = QPointF(0, 0)
         self._guideZoom = 1.0
 
-        self._scratch = QImage(self.screenSize, QImage.Format_RGBA8888)
-        self._scratch.fill(QColor(0, 0, 0, 0))
-        
-        self.drawable = ZXSpectrumBuffer()
+        # Guide downscaled to its size at the base scale, when that is smaller than the loaded
+        # image; wheel zooms use a fast scale and the smooth one follows once the wheel has settled
+        self._guideScaled = None
+        self._guideScaledKey = None
+        self._guideScaledSmooth = False
+        self._guideSmoothTimer = QTimer(self)
+        self._guideSmoothTimer.setSingleShot(True)
+        self._guideSmoothTimer.setInterval(200)
+        self._guideSmoothTimer.timeout.connect(lambda: self.update(self.rect()))
+
+        # Drawing goes to the active layer, while the flattened layers are shown and exported
+        self.layers = LayerStack()
+
+        self.tiles = TileIndexer(self.layers.composite)
+
+        # Animation frames; every layer keeps its own and holds the current one while it is
+        # edited. The flattened frames that are played and exported are rebuilt from them.
+        self._frameRenderer = ZXSpectrumBuffer()
+        self._playIndex = 0
+        self._playPixmap = None
+        self._playTimer = QTimer(self)
+        self._playTimer.timeout.connect(self._nextPlayFrame)
+        self._resetFrames()
 
         self.setCursor(Qt.CrossCursor)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
 
         self._mouseLastPos = self.getLocalMousePos()
         self._mouseDelta = QPoint(0, 0)
+        self._wheelAngle = 0
         self._mousePressed = MouseButton.NONE
         self._drawMode = DrawingMode.DOTTED
 
-        self._lineState = None
+        self._shapeState = None
+        self._shapeFilled = False
+
+        # Brush copied in SELECT mode and stamped in STAMP mode
+        self._brush = None
+        self._stampOp = BlitOp.REPLACE
+        self._stampSnap = False
+        self._lastStamp = None
+
+        # FLASH cells swap ink and paper every 16 frames of the Spectrum's 50Hz display. Both
+        # phases are cached renders, so a tick only repaints the flashing cells.
+        self._flashPhase = False
+        self._flashTimer = QTimer(self)
+        self._flashTimer.setInterval(320)
+        self._flashTimer.timeout.connect(self._toggleFlash)
+        self._flashTimer.start()
+
+        # PEN mode points are collected here and drawn as one polyline per display frame
+        self._stroke = []
+        self._strokeTimer = QTimer(self)
+        screen = QGuiApplication.primaryScreen()
+        self._strokeTimer.setInterval(int(1000 / (screen.refreshRate() if screen else 60.0)))
+        self._strokeTimer.timeout.connect(self._flushStroke)
+
+    @property
+    def drawable(self):
+        return self.layers.active.buffer
+
+    @property
+    def history(self):
+        return self.layers.active.history
 
     def encodeToJSON(self):
+        rdict = self.projectSettings()
+        rdict["drawable"] = self.layers.flattened.encodeToJSON()
+        return rdict
+        
+    def decodeFromJSON(self, json):
+        self.history.end()
+        self.applyProjectSettings(json)
+        self.layers.reset()
+        self.drawable.decodeFromJSON(json["drawable"])
+        self._resetFrames()
+        self.updateDirty()
+        self.layersChanged.emit()
+
+    def projectSettings(self):
         rdict = dict()
         rdict["fg_index"] = self.fgIndex
         rdict["bg_index"] = self.bgIndex
@@ -83,32 +257,58 @@ class RetroDrawWidget(QWidget):
         rdict["guide_filename"] = self._guideFilename
         rdict["guide_enabled"] = self._guideEnabled
         rdict["guide_opacity"] = self._guideOpacity
-        rdict["guide_coords_x"] = self._guideCoords.x()
-        rdict["guide_coords_y"] = self._guideCoords.y()
+        rdict["guide_coords_x"] = round(self._guideCoords.x())
+        rdict["guide_coords_y"] = round(self._guideCoords.y())
         rdict["guide_zoom"] = self._guideZoom
-        rdict["drawable"] = self.drawable.encodeToJSON()
         return rdict
-        
-    def decodeFromJSON(self, json):
-        self.fgIndex = json["fg_index"]
-        self.bgIndex = json["bg_index"]
-        self.palette = json["palette"]
-        self._gridEnabled = json["grid_enabled"]
-        self._gridOpacity = json["grid_opacity"]
-        self._guideFilename = json["guide_filename"]
-        self._guide = QPixmap(self._guideFilename)
-        self._guideEnabled = json["guide_enabled"]
-        self._guideOpacity = json["guide_opacity"]
-        self._guideCoords.setX(json["guide_coords_x"])
-        self._guideCoords.setY(json["guide_coords_y"])
-        self._guideZoom = json["guide_zoom"]
-        self.drawable.decodeFromJSON(json["drawable"])
+
+    def applyProjectSettings(self, settings):
+        self.fgIndex = settings["fg_index"]
+        self.bgIndex = settings["bg_index"]
+        self.palette = settings["palette"]
+        self._gridEnabled = settings["grid_enabled"]
+        self._gridOpacity = settings["grid_opacity"]
+        self._guideFilename = settings["guide_filename"]
+        self._loadGuide()
+        self._guideEnabled = settings["guide_enabled"]
+        self._guideOpacity = settings["guide_opacity"]
+        self._guideCoords.setX(settings["guide_coords_x"])
+        self._guideCoords.setY(settings["guide_coords_y"])
+        self._guideZoom = settings["guide_zoom"]
+
+    def saveProject(self, filename):
+        saveProject(filename, self.projectSettings(), self.layers.flattened, layers=self.layers)
+
+    def loadProject(self, filename):
+        self.history.end()
+        self.layers.reset()
+        self.applyProjectSettings(loadProject(filename, self.drawable, self.layers))
+        self._resetFrames()
+        self.updateDirty()
+        self.update(self.rect())
+        self.layersChanged.emit()
 
     def sizeHint(self):
         return self.screenSize
 
     def minimumSizeHint(self):
-        return self.screenSize
+        return self.canvasSize
+
+    @property
+    def scale(self):
+        return self.viewport.scale
+
+    def setZoom(self, scale, anchor=None):
+        if anchor is None:
+            anchor = self.rect().center()
+        self.viewport.zoom(scale, anchor)
+        self.viewport.clamp(self.size())
+        self.update(self.rect())
+        self.zoomChanged.emit(self.viewport.scale)
+
+    def resizeEvent(self, event):
+        self.viewport.clamp(event.size())
+        super(RetroDrawWidget, self).resizeEvent(event)
     
     def getLocalMousePos(self):
         return self.mapFromGlobal(QCursor.pos())
@@ -118,32 +318,82 @@ class RetroDrawWidget(QWidget):
 
         painter = QPainter(self)
 
-        rectTarget = self.rect()
-        rectSource = QRect(QPoint(0, 0), self.canvasSize)
-        painter.drawPixmap(rectTarget, self.drawable.qpixmap, rectSource)
+        # Only the exposed region is composited; the canvas source is widened to whole
+        # canvas pixels and the painter clips the overdraw to the update region
+        rectTarget = event.rect().intersected(self.rect())
+        screenRect = self.viewport.screenRect
+        if not screenRect.contains(rectTarget):
+            painter.fillRect(rectTarget, Qt.darkGray)
+        rectSource = self.viewport.widgetToCanvas(rectTarget)
+        if not rectSource.isEmpty():
+            pixmap = self._playPixmap if self._playPixmap else self._screenPixmap()
+            painter.drawPixmap(self.viewport.canvasToWidget(rectSource), pixmap, rectSource)
 
         if self._guide and self._guideEnabled:
             painter.setOpacity(self._guideOpacity)
-            self._paintZoomedGuide(painter)
+            painter.setClipRect(rectTarget)
+            self._paintZoomedGuide(painter, rectTarget)
+        elif self._guideLoading and self._guideEnabled:
+            painter.setPen(Qt.black)
+            painter.drawText(self.rect(), Qt.AlignCenter, "Loading guide...")
         if self._gridEnabled:
+            gridRect = rectTarget.intersected(screenRect)
+            painter.setPen(QPen(Qt.black, 0))
+            if self._pixelGridEnabled and self.scale >= self._pixelGridMinScale:
+                painter.setOpacity(self._gridOpacity / 2)
+                self._paintGrid(painter, gridRect, self.viewport.offset, self.scale)
             painter.setOpacity(self._gridOpacity)
-            painter.drawImage(rectTarget, self.grid, rectTarget)
+            self._paintGrid(painter, gridRect, self.viewport.offset, 8 * self.scale)
 
         painter.setOpacity(1.0)
-        painter.drawImage(rectTarget, self._scratch, rectTarget)
+        if self._shapeState:
+            # Only the area updated from _shapeRect is repainted while dragging
+            painter.setPen(Qt.black)
+            start, end = self._shapeCorners()
+            if self._drawMode == DrawingMode.LINE:
+                painter.drawLine(self.viewport.toWidget(start), self.viewport.toWidget(end))
+            elif self._drawMode == DrawingMode.SELECT:
+                painter.setPen(QPen(Qt.black, 0, Qt.DashLine))
+                painter.drawRect(QRectF(self.viewport.toWidget(start), self.viewport.toWidget(end)).normalized())
+            else:
+                if self._shapeFilled:
+                    painter.setBrush(QColor(0, 0, 0, 64))
+                rect = QRectF(self.viewport.toWidget(start), self.viewport.toWidget(end)).normalized()
+                if self._drawMode == DrawingMode.RECT:
+                    painter.drawRect(rect)
+                else:
+                    painter.drawEllipse(rect)
 
         painter.end()
 
+    @staticmethod
+    def _paintGrid(painter, rect, origin, spacing):
+        # Only the lines crossing the exposed rectangle are drawn
+        xs = range(origin.x() - ((origin.x() - rect.left()) // spacing) * spacing, rect.right() + 1, spacing)
+        ys = range(origin.y() - ((origin.y() - rect.top()) // spacing) * spacing, rect.bottom() + 1, spacing)
+        painter.drawLines([QLine(x, rect.top(), x, rect.bottom()) for x in xs] +
+                          [QLine(rect.left(), y, rect.right(), y) for y in ys])
+
     def mousePressEvent(self, event):
         self._mouseLastPos = self.getLocalMousePos()
+
+        if self.isPlaying():
+            self.stop()
+
+        # Everything drawn until the button is released is a single undo step
+        if self._drawMode != DrawingMode.GUIDE:
+            self.history.begin()
         
         if event.button() == Qt.LeftButton:
             self._mousePressed = MouseButton.LEFT
         elif event.button() == Qt.RightButton:
             self._mousePressed = MouseButton.RIGHT
+        elif event.button() == Qt.MiddleButton:
+            self._mousePressed = MouseButton.MIDDLE
             
         if self._drawMode == DrawingMode.PEN:
             if self._mousePressed == MouseButton.LEFT:
+                self._stroke = [self._canvasPos(event.localPos())]
                 self.doDraw(event.localPos(), True)
         
         elif self._drawMode == DrawingMode.DOTTED:
@@ -156,45 +406,59 @@ class RetroDrawWidget(QWidget):
             if self._mousePressed == MouseButton.LEFT:
                 self.doDraw(event.localPos(), False)
                 
-        elif self._drawMode == DrawingMode.LINE:
+        elif self._drawMode in self.SHAPE_MODES:
             if self._mousePressed == MouseButton.LEFT:
-                self._lineState = [event.localPos(), event.localPos()]
-                painter = QPainter(self._scratch)
-                painter.setPen(Qt.black)
-                painter.drawLine(self._lineState[0], self._lineState[1])
-                painter.end()
-                self.update(self.rect())
+                self._shapeState = [self._canvasPos(event.localPos()), self._canvasPos(event.localPos())]
+                self.update(self._shapeRect())
                 
         elif self._drawMode == DrawingMode.ATTR:
             if self._mousePressed == MouseButton.LEFT:
                 self.doDrawAttr(event.localPos())
 
+        elif self._drawMode == DrawingMode.FILL:
+            if self._mousePressed == MouseButton.LEFT:
+                self.doFill(event.localPos())
+
+        elif self._drawMode == DrawingMode.STAMP:
+            if self._mousePressed == MouseButton.LEFT:
+                self._lastStamp = None
+                self.doStamp(event.localPos())
+
     def mouseReleaseEvent(self, event):
-        if self._drawMode == DrawingMode.LINE:
-            if self._mousePressed == MouseButton.LEFT and self._lineState:
-                self._lineState[1] = event.localPos()
-                painter = QPainter(self._scratch)
-                painter.setPen(Qt.black)
-                painter.drawLine(self._lineState[0], self._lineState[1])
-                
-                self.doDrawLine(self._lineState[0], self._lineState[1])
+        if self._stroke:
+            self._flushStroke()
+            self._strokeTimer.stop()
+            self._stroke = []
 
-                painter.end()
-                self._lineState = None
-                self._scratch.fill(QColor(0, 0, 0, 0))
-                self.update(self.rect())
+        if self._drawMode in self.SHAPE_MODES:
+            if self._mousePressed == MouseButton.LEFT and self._shapeState:
+                self._shapeState[1] = self._canvasPos(event.localPos())
+                self.update(self._shapeRect())
+                if self._drawMode == DrawingMode.SELECT:
+                    self.copySelection()
+                else:
+                    self.doDrawShape()
+                self._shapeState = None
 
+        self.history.end()
         self._mousePressed = MouseButton.NONE
 
     def mouseMoveEvent(self, event):
-        oldMousePos = self._mouseLastPos
         newMousePos = self.getLocalMousePos()
         self._mouseDelta = newMousePos - self._mouseLastPos
         self._mouseLastPos = newMousePos
+
+        if self._mousePressed == MouseButton.MIDDLE:
+            self.viewport.pan(self._mouseDelta)
+            self.viewport.clamp(self.size())
+            self.update(self.rect())
+            return
         
         if self._drawMode == DrawingMode.PEN:
             if self._mousePressed == MouseButton.LEFT:
-                self.doDrawLine(oldMousePos, newMousePos)
+                self._stroke.append(self._canvasPos(event.localPos()))
+                if not self._strokeTimer.isActive():
+                    self._strokeTimer.start()
         
         if self._drawMode == DrawingMode.DOTTED:
             if self._mousePressed == MouseButton.LEFT:
@@ -208,32 +472,40 @@ class RetroDrawWidget(QWidget):
                 
         elif self._drawMode == DrawingMode.GUIDE:
             if self._mousePressed == MouseButton.LEFT:
-                self._guideCoords += self._mouseDelta
+                self._guideCoords += QPointF(self._mouseDelta) * (self.baseScale / self.scale)
                 self.update(self.rect())
                 
-        elif self._drawMode == DrawingMode.LINE:
-            if self._mousePressed == MouseButton.LEFT and self._lineState:
-                painter = QPainter(self._scratch)
-                self._scratch.fill(QColor(0, 0, 0, 0))
-                painter.setPen(Qt.black)
-                self._lineState[1] = event.localPos()
-                painter.drawLine(self._lineState[0], self._lineState[1])
-                painter.end()
-                self.update(self.rect())
+        elif self._drawMode in self.SHAPE_MODES:
+            if self._mousePressed == MouseButton.LEFT and self._shapeState:
+                oldRect = self._shapeRect()
+                self._shapeState[1] = self._canvasPos(event.localPos())
+                self.update(oldRect.united(self._shapeRect()))
                
         elif self._drawMode == DrawingMode.ATTR:
             if self._mousePressed == MouseButton.LEFT:
                 self.doDrawAttr(event.localPos())
 
+        elif self._drawMode == DrawingMode.STAMP:
+            if self._mousePressed == MouseButton.LEFT:
+                self.doStamp(event.localPos())
+
                 
     def wheelEvent(self, event):
-        if self._mousePressed:
+        if event.modifiers() & Qt.ControlModifier:
+            # High resolution wheels and touchpads send fractions of a 120 unit step
+            self._wheelAngle += event.angleDelta().y()
+            steps = int(self._wheelAngle / 120)
+            self._wheelAngle -= steps * 120
+            if steps != 0:
+                self.setZoom(self.scale + steps, event.position().toPoint())
+        elif self._mousePressed:
             if self._drawMode == DrawingMode.GUIDE:
                 delta = event.pixelDelta().y() * 0.01
                 if delta != 0.0:
                     self._guideZoom += delta
                     self._guideZoom = self.clamp(self._guideZoom, 0.1, 8.0)
-                    self.update(self.rect())                
+                    self._guideSmoothTimer.start()
+                    self.update(self.rect())
     
     @staticmethod
     def clamp(value, min, max):
@@ -244,51 +516,202 @@ class RetroDrawWidget(QWidget):
         return value
         
     def doDraw(self, localPos, setPixel):
-        x = localPos.x() // self.scale
-        y = localPos.y() // self.scale
+        x, y = self._canvasPos(localPos)
 
         if setPixel:
-            self.drawable.setPixel(x, y, self.fgIndex, self.bgIndex, self.palette)
+            self.drawable.setPixel(x, y, self.fgIndex, self.bgIndex, self.palette, flash=self.flash)
         else:
-            self.drawable.erasePixel(x, y, self.fgIndex, self.bgIndex, self.palette)
+            self.drawable.erasePixel(x, y, self.fgIndex, self.bgIndex, self.palette, flash=self.flash)
 
-        self.update(self.rect())
+        self.updateDirty()
 
     def doDrawAttr(self, localPos):
-        x = localPos.x() // self.scale
-        y = localPos.y() // self.scale
+        x, y = self._canvasPos(localPos)
         
-        self.drawable.setAttr(x, y, self.fgIndex, self.bgIndex, self.palette)
-        self.update(self.rect())
+        self.drawable.setAttr(x, y, self.fgIndex, self.bgIndex, self.palette, flash=self.flash)
+        self.updateDirty()
             
+    def doFill(self, localPos):
+        x, y = self._canvasPos(localPos)
+
+        self.drawable.floodFill(x, y, self.fgIndex, self.bgIndex, self.palette, flash=self.flash)
+        self.updateDirty()
+
+    def doDrawShape(self):
+        (x1, y1), (x2, y2) = self._shapeCorners()
+
+        if self._drawMode == DrawingMode.LINE:
+            self.drawable.drawLine(x1, y1, x2, y2, self.fgIndex, self.bgIndex, self.palette, flash=self.flash)
+        elif self._drawMode == DrawingMode.RECT:
+            self.drawable.drawRect(x1, y1, x2, y2, self.fgIndex, self.bgIndex, self.palette,
+                                   self._shapeFilled, self.flash)
+        else:
+            self.drawable.drawEllipse(x1, y1, x2, y2, self.fgIndex, self.bgIndex, self.palette,
+                                      self._shapeFilled, self.flash)
+        self.updateDirty()
+
+    def copySelection(self):
+        (x1, y1), (x2, y2) = self._shapeCorners()
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        self._brush = self.layers.flattened.copyRegion(x1, y1, x2 - x1 + 1, y2 - y1 + 1)
+
+    def doStamp(self, localPos):
+        if self._brush is None:
+            return
+
+        # The brush is centred on the cursor, or on the nearest cell when snapping
+        x, y = self._canvasPos(localPos)
+        width, height = self._brush.size
+        x = math.floor(x) - width // 2
+        y = math.floor(y) - height // 2
+        if self._stampSnap:
+            x = (x + 4) & ~0x07
+            y = (y + 4) & ~0x07
+
+        # Dragging stamps once per position, so XOR strokes do not cancel themselves out
+        if (x, y) == self._lastStamp:
+            return
+        self._lastStamp = (x, y)
+
+        self.drawable.stamp(self._brush, x, y, self._stampOp)
+        self.updateDirty()
+
     def doDrawLine(self, localStartPos, localEndPos):
-        x1 = localStartPos.x() // self.scale
-        y1 = localStartPos.y() // self.scale
-        x2 = localEndPos.x() // self.scale
-        y2 = localEndPos.y() // self.scale
-        self.drawable.drawLine(x1, y1, x2, y2, self.fgIndex, self.bgIndex, self.palette)
-        self.update(self.rect())
+        x1, y1 = self._canvasPos(localStartPos)
+        x2, y2 = self._canvasPos(localEndPos)
+        self.drawable.drawLine(x1, y1, x2, y2, self.fgIndex, self.bgIndex, self.palette, flash=self.flash)
+        self.updateDirty()
+
+    def _canvasPos(self, localPos):
+        return self.viewport.toCanvas(localPos)
+
+    @Slot()
+    def _flushStroke(self):
+        if len(self._stroke) < 2:
+            # Nothing arrived since the last frame so stop ticking until the mouse moves again
+            self._strokeTimer.stop()
+            return
+
+        self.drawable.drawPolyline(self._stroke, self.fgIndex, self.bgIndex, self.palette, flash=self.flash)
+        self._stroke = self._stroke[-1:]
+        self.updateDirty()
+
+    def updateDirty(self):
+        """
+        Flattens the layers and schedules a repaint of only the attribute cells that changed
+        """
+        self.layers.flatten()
+        cells = self.layers.composite.takeDirtyCells()
+        if len(cells) == self.drawable.ATTR_WIDTH * self.drawable.ATTR_HEIGHT:
+            self.tiles.rebuild()
+            self.tilesChanged.emit(self.tiles.uniqueCount)
+            self.update(self.rect())
+            return
+
+        if cells:
+            self.tiles.update(cells)
+            self.tilesChanged.emit(self.tiles.uniqueCount)
+
+        for x, y in cells:
+            self.update(self.viewport.canvasToWidget(QRect(x * 8, y * 8, 8, 8)))
+
+    def _screenPixmap(self):
+        composite = self.layers.flattened
+        return composite.flashQPixmap if self._flashPhase else composite.qpixmap
+
+    @Slot()
+    def _toggleFlash(self):
+        self._flashPhase = not self._flashPhase
+        ys, xs = self.layers.composite.flashCells()
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            self.update(self.viewport.canvasToWidget(QRect(x * 8, y * 8, 8, 8)))
+
+    def _shapeCorners(self):
+        """
+        Returns the start and end canvas pixels of the shape being dragged, with the end
+        moved onto the square through the start in CIRCLE mode
+        """
+        (x1, y1), (x2, y2) = [(math.floor(x), math.floor(y)) for x, y in self._shapeState]
+        if self._drawMode == DrawingMode.CIRCLE:
+            size = max(abs(x2 - x1), abs(y2 - y1))
+            x2 = x1 + (size if x2 >= x1 else -size)
+            y2 = y1 + (size if y2 >= y1 else -size)
+        return (x1, y1), (x2, y2)
+
+    def _shapeRect(self):
+        """
+        Returns the widget rectangle covered by the preview of the shape being dragged
+        """
+        start, end = self._shapeCorners()
+        return QRectF(self.viewport.toWidget(start), self.viewport.toWidget(end)).normalized(). \
+            toAlignedRect().adjusted(-1, -1, 1, 1)
                 
-    def setColor(self, fgIndex, bgIndex, palette):
+    def setColor(self, fgIndex, bgIndex, palette, flash=False):
         self.fgIndex = fgIndex
         self.bgIndex = bgIndex
         self.palette = palette
+        self.flash = flash
         
-    def saveImage(self, filename, format=None):
-        self.drawable.saveBuffer(filename)
+    def saveImage(self, filename, format=None, scale=1):
+        self.layers.flattened.saveBuffer(filename, format, scale)
+
+    def exportAnimation(self, filename, fps, scale=1):
+        self._flattenFrames()
+        saveAnimation(self.frames, filename, fps, scale)
+
+    def saveSCR(self, filename):
+        self.layers.flattened.saveSCR(filename)
+
+    def exportTiles(self, filename):
+        if filename.lower().endswith(".asm"):
+            self.tiles.exportAssembler(filename)
+        else:
+            self.tiles.exportBinary(filename)
+
+    def loadSCR(self, filename):
+        self.history.end()
+        self.drawable.loadSCR(filename)
+        self.history.clear()
+        self._resetFrames()
+        self.updateDirty()
         
     def setGrid(self, checked):
         self._gridEnabled = checked
         self.repaint()
         
+    def setPixelGrid(self, checked):
+        self._pixelGridEnabled = checked
+        self.update(self.rect())
+
     def setGridOpacity(self, value):
         self._gridOpacity = value / 100.0
         self.repaint()
         
     def setGuideImage(self, filename):
         self._guideFilename = filename
-        self._guide = QPixmap(self._guideFilename)
-        self.repaint()
+        self._loadGuide()
+
+    def _loadGuide(self):
+        self._guide = None
+        self._guideScaledKey = None
+        self._guideLoading = bool(self._guideFilename)
+        if self._guideLoading:
+            loader = GuideLoader(self._guideFilename, self._guideMaxSize)
+            loader.signals.loaded.connect(self._guideLoaded)
+            QThreadPool.globalInstance().start(loader)
+        self.update(self.rect())
+
+    @Slot(str, QImage, float)
+    def _guideLoaded(self, filename, image, scale):
+        # Ignore loads that have been superseded by a newer guide
+        if filename != self._guideFilename:
+            return
+        self._guideLoading = False
+        self._guide = None if image.isNull() else QPixmap.fromImage(image)
+        self._guideScale = scale
+        self._guideScaledKey = None
+        self.update(self.rect())
         
     def setGuide(self, checked):
         self._guideEnabled = checked
@@ -300,39 +723,249 @@ class RetroDrawWidget(QWidget):
         
     def setMode(self, mode):
         self._drawMode = mode
+
+    def setShapeFilled(self, filled):
+        self._shapeFilled = filled
+
+    def setStampOp(self, op):
+        self._stampOp = op
+
+    def setStampSnap(self, snap):
+        self._stampSnap = snap
         
     def clear(self):
-        self.drawable.clear(self.fgIndex, self.bgIndex, self.palette)
-        self.repaint()
+        self.history.begin()
+        self.drawable.clear(self.fgIndex, self.bgIndex, self.palette, flash=self.flash)
+        self.history.end()
+        self.updateDirty()
+
+    def setActiveLayer(self, index):
+        self.history.end()
+        self.layers.setActive(index)
+        self.layersChanged.emit()
+
+    def addLayer(self):
+        self.history.end()
+        frameCount = self.frameCount
+        layer = self.layers.addLayer()
+        # The new layer is empty in every frame
+        for index in range(1, frameCount):
+            layer.frames.insertFrame(index, copyOf=0)
+        self.updateDirty()
+        self.layersChanged.emit()
+
+    def deleteLayer(self):
+        self.history.end()
+        self.layers.removeLayer(self.layers.activeIndex)
+        self.updateDirty()
+        self.layersChanged.emit()
+
+    def moveLayer(self, delta):
+        self.history.end()
+        self.layers.moveLayer(self.layers.activeIndex, self.layers.activeIndex + delta)
+        self.updateDirty()
+        self.layersChanged.emit()
+
+    def setLayerVisible(self, visible):
+        self.layers.setVisible(self.layers.activeIndex, visible)
+        self.updateDirty()
+        self.layersChanged.emit()
+
+    def setLayerOverrideAttributes(self, override):
+        self.layers.setOverrideAttributes(self.layers.activeIndex, override)
+        self.updateDirty()
+        self.layersChanged.emit()
+
+    @property
+    def frameIndex(self):
+        return self._frameIndex
+
+    @property
+    def frameCount(self):
+        return len(self.layers.active.frames)
+
+    def _resetFrames(self):
+        """
+        Replaces the animation with a single frame holding the current layers
+        """
+        if self.isPlaying():
+            self.stop()
+        for layer in self.layers:
+            layer.frames = FrameSequence()
+            layer.frames.insertFrame(0, layer.buffer)
+        self.frames = FrameSequence()
+        self.frames.insertFrame(0, self.layers.flattened)
+        self._frameIndex = 0
+        self._framePixmaps = dict()
+        self.frameChanged.emit(self._frameIndex, self.frameCount)
+
+    def _storeFrame(self):
+        """
+        Stores every layer into its current frame
+        """
+        self.history.end()
+        for layer in self.layers:
+            layer.frames.storeFrame(self._frameIndex, layer.buffer)
+
+    def _loadFrame(self, index):
+        """
+        Loads every layer from a frame
+        """
+        for layer in self.layers:
+            layer.frames.loadFrame(index, layer.buffer)
+
+    def _flattenFrames(self):
+        """
+        Rebuilds the flattened frames from the frames of every layer, leaving the current
+        frame loaded. Loads only touch the cells that differ, so each flatten is partial.
+        """
+        self._storeFrame()
+        self.frames = FrameSequence()
+        for index in range(self.frameCount):
+            self._loadFrame(index)
+            self.frames.insertFrame(index, self.layers.flattened)
+        self._loadFrame(self._frameIndex)
+        self.updateDirty()
+
+    def setFrame(self, index, storeCurrent=True):
+        if storeCurrent:
+            self._storeFrame()
+        self.history.end()
+        self._frameIndex = max(0, min(index, self.frameCount - 1))
+        self._loadFrame(self._frameIndex)
+        for layer in self.layers:
+            layer.history.clear()
+        self.updateDirty()
+        self.frameChanged.emit(self._frameIndex, self.frameCount)
+
+    def addFrame(self):
+        """
+        Inserts a copy of the current frame after it and switches to the copy
+        """
+        self._storeFrame()
+        for layer in self.layers:
+            layer.frames.insertFrame(self._frameIndex + 1, copyOf=self._frameIndex)
+        self.setFrame(self._frameIndex + 1, False)
+
+    def deleteFrame(self):
+        if self.frameCount > 1:
+            for layer in self.layers:
+                layer.frames.removeFrame(self._frameIndex)
+            self.setFrame(self._frameIndex, False)
+
+    def isPlaying(self):
+        return self._playTimer.isActive()
+
+    def play(self, fps):
+        self._flattenFrames()
+        self._playIndex = self._frameIndex
+        self._playTimer.start(int(1000 / fps))
+        self.playingChanged.emit(True)
+
+    def stop(self):
+        self._playTimer.stop()
+        self._playPixmap = None
+        self.update(self.rect())
+        self.playingChanged.emit(False)
+
+    def _framePixmap(self, index):
+        # Renders are cached by frame contents, so identical frames share a pixmap
+        key = self.frames.key(index)
+        pixmap = self._framePixmaps.get(key)
+        if pixmap is None:
+            if len(self._framePixmaps) > 2 * len(self.frames):
+                self._framePixmaps = dict()
+            self.frames.loadFrame(index, self._frameRenderer)
+            pixmap = self._frameRenderer.qpixmap
+            self._framePixmaps[key] = pixmap
+        return pixmap
+
+    @Slot()
+    def _nextPlayFrame(self):
+        self._playIndex = (self._playIndex + 1) % len(self.frames)
+        self._playPixmap = self._framePixmap(self._playIndex)
+        self.update(self.viewport.screenRect)
+
+    def undo(self):
+        self.history.undo()
+        self.updateDirty()
+
+    def redo(self):
+        self.history.redo()
+        self.updateDirty()
 
-    def _paintZoomedGuide(self, painter):
-        guideZoom = self._guide.scaled(self._guide.width() * self._guideZoom,
-                                       self._guide.height() * self._guideZoom, Qt.KeepAspectRatio)
-        pos = QPoint(self._guideCoords.x() + (self.screenCenter.x() - guideZoom.width() / 2),
-                     self._guideCoords.y() + (self.screenCenter.y() - guideZoom.height() / 2))
-        painter.drawPixmap(pos, guideZoom)
+    def _baseGuide(self, smooth):
+        """
+        Returns the pixmap to draw the guide from and its zoom at the base scale. A guide
+        enlarged at the base scale is drawn straight from the loaded image, so the cache is
+        never bigger than that image whatever the zoom.
+        """
+        zoom = self._guideZoom * self._guideScale
+        if zoom >= 1.0:
+            return self._guide, zoom
+        key = (self._guideFilename, self._guideZoom)
+        if key != self._guideScaledKey or (smooth and not self._guideScaledSmooth):
+            mode = Qt.SmoothTransformation if smooth else Qt.FastTransformation
+            self._guideScaled = self._guide.scaled(max(1, int(self._guide.width() * zoom)),
+                                                   max(1, int(self._guide.height() * zoom)),
+                                                   Qt.KeepAspectRatio, mode)
+            self._guideScaledKey = key
+            self._guideScaledSmooth = smooth
+        return self._guideScaled, zoom * self._guide.width() / self._guideScaled.width()
+
+    def _paintZoomedGuide(self, painter, clip, smooth=None, scale=None, offset=None):
+        """
+        Paints the part of the guide inside the clip rectangle for a view scale and canvas
+        offset, by default those of the viewport
+        """
+        if smooth is None:
+            smooth = not self._guideSmoothTimer.isActive()
+        if scale is None:
+            scale = self.scale
+            offset = self.viewport.offset
+        pixmap, zoom = self._baseGuide(smooth)
+        factor = scale / self.baseScale
+        zoom *= factor
+        center = (self._guideCoords + QPointF(self.screenCenter)) * factor + QPointF(offset)
+        width = pixmap.width() * zoom
+        height = pixmap.height() * zoom
+        guideRect = QRectF(center.x() - width / 2, center.y() - height / 2, width, height)
+
+        # Only the visible part of the guide is scaled
+        target = guideRect.intersected(QRectF(clip))
+        if target.isEmpty():
+            return
+        source = QRectF((target.x() - guideRect.x()) / zoom, (target.y() - guideRect.y()) / zoom,
+                        target.width() / zoom, target.height() / zoom)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, smooth)
+        painter.drawPixmap(target, pixmap, source)
         
-    def copyGuide(self):
-        # This isn't the most efficient way to do this but it just needs to be
-        # reasonably fast
-        self.drawable.clear(self.fgIndex, self.bgIndex, self.palette)
+    def copyGuide(self, dither=None):
+        """
+        Copies the guide into the buffer. With no dither the guide is thresholded to the
+        current colors, otherwise each cell gets its own best attribute and is dithered.
+        """
+        if not self._guide:
+            return
+
+        self.history.begin()
 
         guide_copy = QImage(self.screenSize, QImage.Format_RGBA8888)
         guide_copy.fill(QColor("white"))
 
         painter = QPainter(guide_copy)
-        self._paintZoomedGuide(painter)
+        self._paintZoomedGuide(painter, guide_copy.rect(), True, self.baseScale, QPoint(0, 0))
+        painter.end()
         
         shrunk_guide = guide_copy.smoothScaled(self.canvasSize.width(), self.canvasSize.height())
-        mono_guide = shrunk_guide.convertToFormat(QImage.Format_Mono)
-        
-        for x in range(0, self.canvasSize.width()):
-            for y in range(0, self.canvasSize.height()):
-                if mono_guide.pixel(x, y) == QColor("black"):
-                      self.drawable.setPixel(x, y, self.fgIndex, self.bgIndex, self.palette)      
-
-        painter.end()
-        self.repaint()
+        if dither is None:
+            mono_guide = shrunk_guide.convertToFormat(QImage.Format_Mono)
+            self.drawable.importBitmap(qimageToArray(mono_guide), self.fgIndex, self.bgIndex, self.palette,
+                                       flash=self.flash)
+        else:
+            self.drawable.importImage(qimageToRGB(shrunk_guide), dither)
+        self.history.end()
+        self.updateDirty()
 
 class Form(QDialog):
     def __init__(self, parent=None):
@@ -371,6 +1004,49 @@ class Form(QDialog):
         attr_mode.setChecked(False)
         attr_mode.clicked.connect(lambda: self._retroWidget.setMode(DrawingMode.ATTR))
         modes.addWidget(attr_mode)
+        # Fill mode
+        fill_mode = QRadioButton("Fill Mode")
+        fill_mode.setChecked(False)
+        fill_mode.clicked.connect(lambda: self._retroWidget.setMode(DrawingMode.FILL))
+        modes.addWidget(fill_mode)
+        # Shape modes
+        rect_mode = QRadioButton("Rect Mode")
+        rect_mode.setChecked(False)
+        rect_mode.clicked.connect(lambda: self._retroWidget.setMode(DrawingMode.RECT))
+        modes.addWidget(rect_mode)
+        ellipse_mode = QRadioButton("Ellipse Mode")
+        ellipse_mode.setChecked(False)
+        ellipse_mode.clicked.connect(lambda: self._retroWidget.setMode(DrawingMode.ELLIPSE))
+        modes.addWidget(ellipse_mode)
+        circle_mode = QRadioButton("Circle Mode")
+        circle_mode.setChecked(False)
+        circle_mode.clicked.connect(lambda: self._retroWidget.setMode(DrawingMode.CIRCLE))
+        modes.addWidget(circle_mode)
+        shape_filled = QCheckBox("Filled")
+        shape_filled.setChecked(False)
+        shape_filled.clicked.connect(self._retroWidget.setShapeFilled)
+        modes.addWidget(shape_filled)
+        # Select and stamp modes
+        select_mode = QRadioButton("Select Mode")
+        select_mode.setChecked(False)
+        select_mode.clicked.connect(lambda: self._retroWidget.setMode(DrawingMode.SELECT))
+        modes.addWidget(select_mode)
+        stamp_mode = QRadioButton("Stamp Mode")
+        stamp_mode.setChecked(False)
+        stamp_mode.clicked.connect(lambda: self._retroWidget.setMode(DrawingMode.STAMP))
+        modes.addWidget(stamp_mode)
+        self._stamp_op_combo = QComboBox()
+        self._stamp_op_combo.addItem("Replace", BlitOp.REPLACE)
+        self._stamp_op_combo.addItem("OR", BlitOp.OR)
+        self._stamp_op_combo.addItem("AND", BlitOp.AND)
+        self._stamp_op_combo.addItem("XOR", BlitOp.XOR)
+        self._stamp_op_combo.currentIndexChanged.connect(
+            lambda: self._retroWidget.setStampOp(self._stamp_op_combo.currentData()))
+        modes.addWidget(self._stamp_op_combo)
+        stamp_snap = QCheckBox("Snap to cells")
+        stamp_snap.setChecked(False)
+        stamp_snap.clicked.connect(self._retroWidget.setStampSnap)
+        modes.addWidget(stamp_snap)
         # Guide mode
         guide_mode = QRadioButton("Guide Mode")
         guide_mode.setChecked(False)
@@ -378,10 +1054,24 @@ class Form(QDialog):
         modes.addWidget(guide_mode)
 
         buttons = QHBoxLayout()
+        # Undo/redo buttons
+        undo_button = QPushButton("Undo")
+        undo_button.clicked.connect(self._retroWidget.undo)
+        buttons.addWidget(undo_button)
+        redo_button = QPushButton("Redo")
+        redo_button.clicked.connect(self._retroWidget.redo)
+        buttons.addWidget(redo_button)
+        QShortcut(QKeySequence.Undo, self, self._retroWidget.undo)
+        QShortcut(QKeySequence.Redo, self, self._retroWidget.redo)
         # Save image button
         save_button = QPushButton("Save")
         save_button.clicked.connect(self._saveImage)
         buttons.addWidget(save_button)
+        buttons.addWidget(QLabel("Scale:"))
+        self._export_scale_spin = QSpinBox()
+        self._export_scale_spin.setRange(1, 8)
+        self._export_scale_spin.setValue(1)
+        buttons.addWidget(self._export_scale_spin)
         # Load guide image button
         load_guide_button = QPushButton("Load guide")
         load_guide_button.clicked.connect(self._setGuideImage)
@@ -398,6 +1088,11 @@ class Form(QDialog):
         enable_grid_check.clicked.connect(self._setGrid)
         self._retroWidget.setGrid(True)
         buttons.addWidget(enable_grid_check)
+        # Enable pixel grid check box
+        enable_pixel_grid_check = QCheckBox("Pixel Grid")
+        enable_pixel_grid_check.setChecked(False)
+        enable_pixel_grid_check.clicked.connect(self._retroWidget.setPixelGrid)
+        buttons.addWidget(enable_pixel_grid_check)
         # Clear screen
         clear_screen_button = QPushButton("Clear Screen")
         clear_screen_button.clicked.connect(self._clearScreen)
@@ -406,6 +1101,13 @@ class Form(QDialog):
         copy_guide_button = QPushButton("Copy Guide")
         copy_guide_button.clicked.connect(self._copyGuide)
         buttons.addWidget(copy_guide_button)
+        # Copy Guide conversion
+        self._copy_guide_combo = QComboBox()
+        self._copy_guide_combo.addItem("Mono", None)
+        self._copy_guide_combo.addItem("Color (ordered)", Dither.ORDERED)
+        self._copy_guide_combo.addItem("Color (diffusion)", Dither.DIFFUSION)
+        self._copy_guide_combo.addItem("Color (no dither)", Dither.NONE)
+        buttons.addWidget(self._copy_guide_combo)
         # Save Project
         save_project_button = QPushButton("Save Project")
         save_project_button.clicked.connect(self._saveProject)
@@ -414,6 +1116,18 @@ class Form(QDialog):
         load_project_button = QPushButton("Load Project")
         load_project_button.clicked.connect(self._loadProject)
         buttons.addWidget(load_project_button)
+        # Save SCR
+        save_scr_button = QPushButton("Save SCR")
+        save_scr_button.clicked.connect(self._saveSCR)
+        buttons.addWidget(save_scr_button)
+        # Load SCR
+        load_scr_button = QPushButton("Load SCR")
+        load_scr_button.clicked.connect(self._loadSCR)
+        buttons.addWidget(load_scr_button)
+        # Export Tiles
+        export_tiles_button = QPushButton("Export Tiles")
+        export_tiles_button.clicked.connect(self._exportTiles)
+        buttons.addWidget(export_tiles_button)
                 
         sliders = QHBoxLayout()
         # Guide slider
@@ -436,11 +1150,88 @@ class Form(QDialog):
         grid_slider.setValue(20)
         self._retroWidget.setGridOpacity(20)
         sliders.addWidget(grid_slider)
+        # Zoom
+        sliders.addWidget(QLabel("Zoom:"))
+        zoom_spin = QSpinBox()
+        zoom_spin.setRange(Viewport.MIN_SCALE, Viewport.MAX_SCALE)
+        zoom_spin.setSuffix("x")
+        zoom_spin.setValue(self._retroWidget.scale)
+        zoom_spin.valueChanged.connect(self._retroWidget.setZoom)
+        self._retroWidget.zoomChanged.connect(zoom_spin.setValue)
+        sliders.addWidget(zoom_spin)
+
+        frames = QHBoxLayout()
+        # Frame selection
+        frames.addWidget(QLabel("Frame:"))
+        self._frame_spin = QSpinBox()
+        self._frame_spin.setRange(1, 1)
+        self._frame_spin.valueChanged.connect(lambda value: self._retroWidget.setFrame(value - 1))
+        frames.addWidget(self._frame_spin)
+        self._frame_count_label = QLabel("of 1")
+        frames.addWidget(self._frame_count_label)
+        self._retroWidget.frameChanged.connect(self._frameChanged)
+        # Add and delete frame buttons
+        add_frame_button = QPushButton("Add Frame")
+        add_frame_button.clicked.connect(self._retroWidget.addFrame)
+        frames.addWidget(add_frame_button)
+        delete_frame_button = QPushButton("Delete Frame")
+        delete_frame_button.clicked.connect(self._retroWidget.deleteFrame)
+        frames.addWidget(delete_frame_button)
+        # Playback
+        self._play_button = QPushButton("Play")
+        self._play_button.setCheckable(True)
+        self._play_button.clicked.connect(self._play)
+        frames.addWidget(self._play_button)
+        self._retroWidget.playingChanged.connect(self._playingChanged)
+        frames.addWidget(QLabel("FPS:"))
+        self._fps_spin = QSpinBox()
+        self._fps_spin.setRange(1, 50)
+        self._fps_spin.setValue(12)
+        frames.addWidget(self._fps_spin)
+        export_animation_button = QPushButton("Export Animation")
+        export_animation_button.clicked.connect(self._exportAnimation)
+        frames.addWidget(export_animation_button)
+        # Unique tile count
+        frames.addSpacing(20)
+        tiles_label = QLabel("Tiles: {}".format(self._retroWidget.tiles.uniqueCount))
+        self._retroWidget.tilesChanged.connect(lambda count: tiles_label.setText("Tiles: {}".format(count)))
+        frames.addWidget(tiles_label)
+
+        layers = QHBoxLayout()
+        # Layer selection
+        layers.addWidget(QLabel("Layer:"))
+        self._layer_combo = QComboBox()
+        self._layer_combo.activated.connect(self._retroWidget.setActiveLayer)
+        layers.addWidget(self._layer_combo)
+        self._layer_visible_check = QCheckBox("Visible")
+        self._layer_visible_check.clicked.connect(self._retroWidget.setLayerVisible)
+        layers.addWidget(self._layer_visible_check)
+        self._layer_override_check = QCheckBox("Own Attributes")
+        self._layer_override_check.clicked.connect(self._retroWidget.setLayerOverrideAttributes)
+        layers.addWidget(self._layer_override_check)
+        # Layer buttons
+        add_layer_button = QPushButton("Add Layer")
+        add_layer_button.clicked.connect(self._retroWidget.addLayer)
+        layers.addWidget(add_layer_button)
+        delete_layer_button = QPushButton("Delete Layer")
+        delete_layer_button.clicked.connect(self._retroWidget.deleteLayer)
+        layers.addWidget(delete_layer_button)
+        raise_layer_button = QPushButton("Raise")
+        raise_layer_button.clicked.connect(lambda: self._retroWidget.moveLayer(1))
+        layers.addWidget(raise_layer_button)
+        lower_layer_button = QPushButton("Lower")
+        lower_layer_button.clicked.connect(lambda: self._retroWidget.moveLayer(-1))
+        layers.addWidget(lower_layer_button)
+        layers.addStretch()
+        self._retroWidget.layersChanged.connect(self._layersChanged)
+        self._layersChanged()
 
         layout = QVBoxLayout()
         layout.addLayout(modes)
         layout.addLayout(buttons)
         layout.addLayout(sliders)
+        layout.addLayout(frames)
+        layout.addLayout(layers)
         layout.addSpacing(10)
         layout.addWidget(self._paletteWidget)
         layout.addSpacing(10)
@@ -449,9 +1240,49 @@ class Form(QDialog):
         # Set dialog layout
         self.setLayout(layout)
         
+    @Slot()
+    def _playingChanged(self, playing):
+        self._play_button.blockSignals(True)
+        self._play_button.setChecked(playing)
+        self._play_button.blockSignals(False)
+
+    @Slot()
+    def _frameChanged(self, index, count):
+        self._frame_spin.blockSignals(True)
+        self._frame_spin.setRange(1, count)
+        self._frame_spin.setValue(index + 1)
+        self._frame_spin.blockSignals(False)
+        self._frame_count_label.setText("of {}".format(count))
+
+    @Slot()
+    def _layersChanged(self):
+        layers = self._retroWidget.layers
+        self._layer_combo.clear()
+        self._layer_combo.addItems([layers[index].name for index in range(len(layers))])
+        self._layer_combo.setCurrentIndex(layers.activeIndex)
+        self._layer_visible_check.setChecked(layers.active.visible)
+        self._layer_override_check.setChecked(layers.active.overrideAttributes)
+
+    @Slot()
+    def _play(self, checked):
+        if checked:
+            self._retroWidget.play(self._fps_spin.value())
+        else:
+            self._retroWidget.stop()
+
     @Slot()
     def _saveImage(self):
-        self._retroWidget.saveImage("output.png")
+        filename = QFileDialog.getSaveFileName(self, "Save image", "output.png",
+                                               "PNG Images (*.png);;GIF Images (*.gif);;BMP Images (*.bmp)")
+        if filename[0]:
+            self._retroWidget.saveImage(filename[0], scale=self._export_scale_spin.value())
+
+    @Slot()
+    def _exportAnimation(self):
+        filename = QFileDialog.getSaveFileName(self, "Export animation", ".",
+                                               "Animated GIF (*.gif);;Animated PNG (*.png)")
+        if filename[0]:
+            self._retroWidget.exportAnimation(filename[0], self._fps_spin.value(), self._export_scale_spin.value())
         
     @Slot()
     def _setGrid(self, checked):
@@ -481,18 +1312,39 @@ class Form(QDialog):
         
     @Slot()
     def _copyGuide(self):
-        self._retroWidget.copyGuide()
+        self._retroWidget.copyGuide(self._copy_guide_combo.currentData())
         
     @Slot()
     def _saveProject(self):
-        with open("test_proj.json", "w") as output:
-            json.dump(self._retroWidget.encodeToJSON(), output)
+        filename = QFileDialog.getSaveFileName(self, "Save project", ".", "Retro Draw Projects (*.rdp)")
+        if filename[0]:
+            self._retroWidget.saveProject(filename[0])
             
     @Slot()
     def _loadProject(self):
-        with open("test_proj.json", "r") as input:
-            self._retroWidget.decodeFromJSON(json.load(input))
-        self._retroWidget.repaint()
+        filename = QFileDialog.getOpenFileName(self, "Load project", ".",
+                                               "Retro Draw Projects (*.rdp *.json)")
+        if filename[0]:
+            self._retroWidget.loadProject(filename[0])
+
+    @Slot()
+    def _saveSCR(self):
+        filename = QFileDialog.getSaveFileName(self, "Save SCR file", ".", "Spectrum Screens (*.scr)")
+        if filename[0]:
+            self._retroWidget.saveSCR(filename[0])
+
+    @Slot()
+    def _loadSCR(self):
+        filename = QFileDialog.getOpenFileName(self, "Load SCR file", ".", "Spectrum Screens (*.scr)")
+        if filename[0]:
+            self._retroWidget.loadSCR(filename[0])
+
+    @Slot()
+    def _exportTiles(self):
+        filename = QFileDialog.getSaveFileName(self, "Export tiles", ".",
+                                               "Assembler (*.asm);;Binary charset, map and attributes (*.chr)")
+        if filename[0]:
+            self._retroWidget.exportTiles(filename[0])
 
 if __name__ == "__main__":
     # Create the Qt Application
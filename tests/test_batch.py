@@ -0,0 +1,18 @@
+import os
+import pytest
+
+from retmod.batch import outputBases
+
+def test_inputs_sharing_a_name_get_their_extension():
+    assert outputBases(["a/x.scr", "a/x.rdp"]) == [os.path.join("a", "x_scr"), os.path.join("a", "x_rdp")]
+
+def test_output_dir_keeps_relative_directories(tmp_path):
+    bases = outputBases(["a/x.scr", "b/x.scr"], str(tmp_path))
+    assert bases == [str(tmp_path / "a" / "x"), str(tmp_path / "b" / "x")]
+
+def test_outputs_never_overwrite_inputs():
+    assert outputBases(["photo.png"], machine="c64") == ["photo_c64"]
+    assert outputBases(["x.scr"]) == ["x"]
+    assert outputBases(["x.scr"], native=True) == ["x_zx"]
+    with pytest.raises(ValueError):
+        outputBases(["photo.png", "photo_c64.png"], machine="c64")
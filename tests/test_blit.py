@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from retmod.zxbuffer import ZXSpectrumBuffer, BlitOp
+
+def randomBuffer(seed):
+    rng = np.random.default_rng(seed)
+    buffer = ZXSpectrumBuffer()
+    buffer.setContents(rng.integers(0, 256, (192, 32), dtype=np.uint8),
+                       rng.integers(0, 256, (24, 32), dtype=np.uint8))
+    return buffer
+
+def pixels(buffer):
+    return np.unpackbits(buffer.bitmap, axis=1).astype(bool)
+
+def test_row_offsets_follow_scr_layout():
+    ys = np.arange(192)
+    expected = ((ys & 0xc0) << 5) | ((ys & 0x07) << 8) | ((ys & 0x38) << 2)
+    assert (ZXSpectrumBuffer._rowOffsets(ys) == expected).all()
+
+    buffer = randomBuffer(0)
+    assert (buffer.screen[expected[:, np.newaxis] + np.arange(32)] == buffer.bitmap).all()
+
+@pytest.mark.parametrize("x, y, width, height", [(0, 0, 16, 8), (3, 5, 21, 13), (250, 187, 20, 20), (-5, -3, 12, 9)])
+def test_copy_region_matches_pixels(x, y, width, height):
+    buffer = randomBuffer(1)
+    brush = buffer.copyRegion(x, y, width, height)
+
+    x1, y1 = max(x, 0), max(y, 0)
+    x2, y2 = min(x + width, 256), min(y + height, 192)
+    assert brush.size == (x2 - x1, y2 - y1)
+    copied = np.unpackbits(brush.bitmap, axis=1)[:, :x2 - x1].astype(bool)
+    assert (copied == pixels(buffer)[y1:y2, x1:x2]).all()
+    # Bits past the width of the brush are left clear
+    assert not np.unpackbits(brush.bitmap, axis=1)[:, x2 - x1:].any()
+
+def referenceStamp(buffer, brush, x, y, op, attributes):
+    """
+    Stamps pixel by pixel, returning the expected pixels and attributes
+    """
+    result = pixels(buffer)
+    attrs = buffer.attributes.copy()
+    width, height = brush.size
+    source = np.unpackbits(brush.bitmap, axis=1)[:, :width].astype(bool)
+    for row in range(height):
+        for column in range(width):
+            px, py = x + column, y + row
+            if not (0 <= px < 256 and 0 <= py < 192):
+                continue
+            if op == BlitOp.OR:
+                result[py, px] |= source[row, column]
+            elif op == BlitOp.AND:
+                result[py, px] &= source[row, column]
+            elif op == BlitOp.XOR:
+                result[py, px] ^= source[row, column]
+            else:
+                result[py, px] = source[row, column]
+            if attributes:
+                # A cell takes the brush attribute over its top left covered pixel
+                cellX, cellY = px >> 3, py >> 3
+                left, top = max(cellX * 8, x), max(cellY * 8, y)
+                attrs[cellY, cellX] = brush.attributes[(top - y) >> 3, (left - x) >> 3]
+    return result, attrs
+
+@pytest.mark.parametrize("op", list(BlitOp))
+@pytest.mark.parametrize("x, y", [(0, 0), (3, 5), (13, 170), (245, 185), (-6, -4)])
+@pytest.mark.parametrize("attributes", [True, False])
+def test_stamp_matches_reference(op, x, y, attributes):
+    brush = randomBuffer(2).copyRegion(5, 9, 19, 11)
+    buffer = randomBuffer(3)
+    expected, expectedAttrs = referenceStamp(buffer, brush, x, y, op, attributes)
+
+    buffer.stamp(brush, x, y, op, attributes)
+    assert (pixels(buffer) == expected).all()
+    assert (buffer.attributes == expectedAttrs).all()
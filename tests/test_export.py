@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from retmod.zxbuffer import ZXSpectrumBuffer
+from retmod.machines import C64MulticolourBuffer, CPCMode2Buffer
+from retmod.animation import FrameSequence
+from retmod.export import saveAnimation
+
+def randomBuffer(rng):
+    buffer = ZXSpectrumBuffer()
+    buffer.setContents(rng.integers(0, 256, (192, 32), dtype=np.uint8),
+                       rng.integers(0, 128, (24, 32), dtype=np.uint8))
+    return buffer
+
+def upscale(rgb, scaleX, scaleY):
+    return np.repeat(np.repeat(rgb, scaleY, axis=0), scaleX, axis=1)
+
+@pytest.mark.parametrize("cls, scale, aspect", [(ZXSpectrumBuffer, 1, (1, 1)), (ZXSpectrumBuffer, 3, (1, 1)),
+                                                (C64MulticolourBuffer, 2, (2, 1)), (CPCMode2Buffer, 1, (1, 2))])
+def test_indexed_png_matches_render(tmp_path, cls, scale, aspect):
+    rng = np.random.default_rng(0)
+    buffer = cls()
+    buffer.importImage(rng.integers(0, 256, (cls.HEIGHT, cls.WIDTH, 3), dtype=np.uint8))
+    filename = str(tmp_path / "screen.png")
+    buffer.saveBuffer(filename, scale=scale)
+
+    image = Image.open(filename)
+    assert image.mode == "P"
+    expected = upscale(buffer.rgb, scale * aspect[0], scale * aspect[1])
+    assert (np.asarray(image.convert("RGB")) == expected).all()
+
+def test_non_palette_format_falls_back_to_rgb(tmp_path):
+    filename = str(tmp_path / "screen.jpg")
+    ZXSpectrumBuffer().saveBuffer(filename)
+    assert Image.open(filename).mode == "RGB"
+
+@pytest.mark.parametrize("extension", [".gif", ".png"])
+@pytest.mark.parametrize("scale", [1, 2])
+def test_animation_frames_decode_back(tmp_path, extension, scale):
+    rng = np.random.default_rng(1)
+    frames = FrameSequence()
+    screens = [randomBuffer(rng) for _ in range(3)]
+    # The repeated frame is written once with twice the delay
+    for index, screen in enumerate([screens[0], screens[1], screens[1], screens[2]]):
+        frames.insertFrame(index, screen)
+    filename = str(tmp_path / ("animation" + extension))
+    saveAnimation(frames, filename, 10, scale)
+
+    image = Image.open(filename)
+    assert image.n_frames == 3
+    for index, (screen, duration) in enumerate(zip(screens, (100, 200, 100))):
+        image.seek(index)
+        assert image.info["duration"] == duration
+        assert (np.asarray(image.convert("RGB")) == upscale(screen.rgb, scale, scale)).all()
+
+def test_gif_delays_keep_the_overall_rate(tmp_path):
+    rng = np.random.default_rng(2)
+    frames = FrameSequence()
+    for index in range(6):
+        frames.insertFrame(index, randomBuffer(rng))
+    filename = str(tmp_path / "animation.gif")
+    saveAnimation(frames, filename, 12)
+
+    image = Image.open(filename)
+    durations = []
+    for index in range(image.n_frames):
+        image.seek(index)
+        durations.append(image.info["duration"])
+    assert sum(durations) == 500
+    assert set(durations) <= {80, 90}
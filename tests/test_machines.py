@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from retmod.machines import C64MulticolourBuffer, MSXScreen2Buffer, CPCMode0Buffer, CPCMode1Buffer, CPCMode2Buffer
+
+def test_koala_layout(tmp_path):
+    buffer = C64MulticolourBuffer()
+    buffer.cellColors[1, 1] = (0, 2, 5, 7)
+    buffer.setSharedColor(0, 6)
+    buffer.pixels[9, 5] = 2
+    filename = str(tmp_path / "screen.kla")
+    buffer.saveNative(filename)
+
+    data = open(filename, "rb").read()
+    assert len(data) == 10003
+    assert data[:2] == b"\x00\x60"
+    # Cell (1, 1) is the 41st, pixel 1 of its second line is bits 5-4
+    assert data[2 + 41 * 8 + 1] == 0x20
+    assert data[2 + 8000 + 41] == 0x25
+    assert data[2 + 9000 + 41] == 7
+    assert data[10002] == 6
+
+def test_msx_screen2_layout(tmp_path):
+    buffer = MSXScreen2Buffer()
+    buffer.cellColors[70, 1] = (4, 15)
+    buffer.pixels[70, 10] = 1
+    filename = str(tmp_path / "screen.sc2")
+    buffer.saveNative(filename)
+
+    data = open(filename, "rb").read()
+    assert data[:7] == bytes([0xfe, 0x00, 0x00, 0xff, 0x37, 0x00, 0x00])
+    vram = data[7:]
+    assert len(vram) == 0x3800
+    # Line 70 is line 6 of character row 0 in the second third
+    offset = 2048 + 0 * 256 + 1 * 8 + 6
+    assert vram[offset] == 0x20
+    assert vram[0x2000 + offset] == 0xf4
+    assert vram[0x1800:0x1b00] == bytes(range(256)) * 3
+
+@pytest.mark.parametrize("cls, x, pen, column, value", [
+    (CPCMode0Buffer, 3, 10, 1, 0x05),
+    (CPCMode1Buffer, 5, 3, 1, 0x44),
+    (CPCMode2Buffer, 13, 1, 1, 0x04),
+])
+def test_cpc_layout(tmp_path, cls, x, pen, column, value):
+    buffer = cls()
+    buffer.cellColors[0, 0] = np.arange(cls.SLOTS) + 1
+    buffer.pixels[9, x] = pen
+    filename = str(tmp_path / "screen.bin")
+    buffer.saveNative(filename)
+
+    data = open(filename, "rb").read()
+    assert len(data) == 0x4000
+    # Line 9 is line 1 of character row 1
+    offset = 0x800 + 80 + column
+    assert data[offset] == value
+    assert np.count_nonzero(np.frombuffer(data, dtype=np.uint8)) == 1
+    assert open(str(tmp_path / "screen.pal"), "rb").read() == bytes(range(1, cls.SLOTS + 1))
+
+@pytest.mark.parametrize("cls", [C64MulticolourBuffer, MSXScreen2Buffer, CPCMode0Buffer, CPCMode1Buffer])
+def test_import_keeps_cell_constraints(cls):
+    rng = np.random.default_rng(0)
+    buffer = cls()
+    buffer.importImage(rng.integers(0, 256, (cls.HEIGHT, cls.WIDTH, 3), dtype=np.uint8))
+
+    cells = buffer.indexImage().reshape(cls.HEIGHT // cls.CELL_HEIGHT, cls.CELL_HEIGHT,
+                                        cls.WIDTH // cls.CELL_WIDTH, cls.CELL_WIDTH)
+    colors = cells.transpose(0, 2, 1, 3).reshape(-1, cls.CELL_HEIGHT * cls.CELL_WIDTH)
+    assert max(len(np.unique(cell)) for cell in colors) <= cls.SLOTS
+    if cls.SHARED_SLOTS:
+        assert (buffer.cellColors[..., 0] == buffer.cellColors[0, 0, 0]).all()
+
+def test_set_pixels_takes_least_used_slot():
+    buffer = C64MulticolourBuffer()
+    buffer.setPixels(np.array([0, 1]), np.array([0, 0]), 5)
+    assert buffer.getPixel(0, 0) == 5 and buffer.getPixel(1, 0) == 5
+    # The shared background slot is never given a cell's own colour
+    assert buffer.cellColors[0, 0, 0] == 0
+    assert buffer.getPixel(2, 0) == 0
@@ -0,0 +1,134 @@
+import json
+import struct
+import zlib
+import numpy as np
+import pytest
+
+from retmod.zxbuffer import ZXSpectrumBuffer
+from retmod.layers import LayerStack
+from retmod import project
+
+from tests.test_blit import randomBuffer
+
+SETTINGS = {"fg_index": 2, "bg_index": 7, "palette": 1, "grid_enabled": True, "grid_opacity": 0.25,
+            "guide_filename": "guide.png", "guide_enabled": False, "guide_opacity": 0.5,
+            "guide_coords_x": -3, "guide_coords_y": 12, "guide_zoom": 2.0}
+
+@pytest.mark.parametrize("x, y", [(0, 0), (7, 0), (8, 1), (255, 7), (0, 8), (100, 63), (0, 64), (255, 191)])
+def test_pixel_byte_offset(x, y):
+    buffer = ZXSpectrumBuffer()
+    buffer.setPixel(x, y, 2, 7, 1)
+
+    offset = ((y & 0xc0) << 5) | ((y & 0x07) << 8) | ((y & 0x38) << 2) | (x >> 3)
+    expected = np.zeros(6144, dtype=np.uint8)
+    expected[offset] = 0x80 >> (x & 7)
+    assert (buffer.screen[:6144] == expected).all()
+
+@pytest.mark.parametrize("x, y", [(0, 0), (31, 0), (0, 1), (17, 13), (31, 23)])
+def test_attribute_byte_offset(x, y):
+    buffer = ZXSpectrumBuffer()
+    expected = buffer.screen.copy()
+    buffer.setAttr(x * 8, y * 8, 5, 2, 1, flash=True)
+
+    expected[6144 + y * 32 + x] = 0x80 | 0x40 | (2 << 3) | 5
+    assert (buffer.screen == expected).all()
+
+def test_scr_round_trip(tmp_path):
+    buffer = randomBuffer(2)
+    filename = str(tmp_path / "image.scr")
+    buffer.saveSCR(filename)
+    assert (tmp_path / "image.scr").read_bytes() == buffer.screen.tobytes()
+
+    for mmap in (False, True):
+        loaded = ZXSpectrumBuffer()
+        loaded.loadSCR(filename, mmap=mmap)
+        assert (loaded.bitmap == buffer.bitmap).all()
+        assert (loaded.attributes == buffer.attributes).all()
+
+    screen = ZXSpectrumBuffer()
+    screen.setScreen(buffer.screen.tobytes())
+    assert (screen.screen == buffer.screen).all()
+    with pytest.raises(ValueError):
+        screen.setScreen(bytes(6911))
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_encode_decode(compress):
+    buffer = randomBuffer(3)
+    data = project.encodeProject(SETTINGS, buffer, compress=compress)
+    magic, version, flags = struct.unpack_from("<4sHH", data)
+    assert (magic, version) == (project.MAGIC, project.VERSION)
+    assert flags == (project.FLAG_COMPRESSED if compress else 0)
+
+    decoded = ZXSpectrumBuffer()
+    assert project.decodeProject(data, decoded) == SETTINGS
+    assert (decoded.screen == buffer.screen).all()
+
+def test_encode_decode_layers():
+    layers = LayerStack()
+    layers[0].buffer.setContents(randomBuffer(4).bitmap, randomBuffer(4).attributes)
+    layers.addLayer("Top").buffer.drawRect(10, 20, 90, 70, 1, 0, 0, filled=True)
+    layers.setOverrideAttributes(1, True)
+    layers.addLayer("Hidden").buffer.setPixel(5, 5, 3, 0, 0)
+    layers.setVisible(2, False)
+    layers.setActive(1)
+
+    data = project.encodeProject(SETTINGS, layers.flattened, layers=layers)
+    assert struct.unpack_from("<4sHH", data)[2] & project.FLAG_LAYERS
+
+    restored = LayerStack()
+    decoded = ZXSpectrumBuffer()
+    assert project.decodeProject(data, decoded, restored) == SETTINGS
+    assert (decoded.screen == layers.flattened.screen).all()
+    assert len(restored) == 3 and restored.activeIndex == 1
+    for original, layer in zip(layers, restored):
+        assert layer.name == original.name
+        assert layer.visible == original.visible
+        assert layer.overrideAttributes == original.overrideAttributes
+        assert (layer.buffer.screen == original.buffer.screen).all()
+    assert (restored.flattened.screen == layers.flattened.screen).all()
+
+    # A project without layers leaves the stack alone
+    project.decodeProject(project.encodeProject(SETTINGS, decoded), decoded, restored)
+    assert len(restored) == 3
+
+def test_decode_version_1():
+    buffer = randomBuffer(5)
+    screen = zlib.compress(buffer.screen.tobytes())
+    guide = SETTINGS["guide_filename"].encode("utf-8")
+    data = b"".join([struct.pack("<4sHH", project.MAGIC, 1, project.FLAG_COMPRESSED),
+                     struct.pack("<BBB?d?diid", 2, 7, 1, True, 0.25, False, 0.5, -3, 12, 2.0),
+                     struct.pack("<H", len(guide)), guide,
+                     struct.pack("<I", len(screen)), screen])
+
+    layers = LayerStack()
+    decoded = ZXSpectrumBuffer()
+    assert project.decodeProject(data, decoded, layers) == SETTINGS
+    assert (decoded.screen == buffer.screen).all()
+    assert len(layers) == 1
+
+def test_decode_rejects_bad_headers():
+    data = project.encodeProject(SETTINGS, ZXSpectrumBuffer())
+    with pytest.raises(ValueError):
+        project.decodeProject(b"XXXX" + data[4:], ZXSpectrumBuffer())
+    with pytest.raises(ValueError):
+        project.decodeProject(data[:4] + struct.pack("<H", project.VERSION + 1) + data[6:], ZXSpectrumBuffer())
+
+def test_load_project(tmp_path):
+    buffer = randomBuffer(6)
+    filename = str(tmp_path / "image.rdp")
+    project.saveProject(filename, SETTINGS, buffer)
+
+    loaded = ZXSpectrumBuffer()
+    assert project.loadProject(filename, loaded) == SETTINGS
+    assert (loaded.screen == buffer.screen).all()
+
+def test_load_legacy_json(tmp_path):
+    buffer = randomBuffer(7)
+    settings = dict(SETTINGS, drawable=buffer.encodeToJSON())
+    filename = tmp_path / "legacy.json"
+    filename.write_text(json.dumps(settings))
+
+    loaded = ZXSpectrumBuffer()
+    assert project.loadProject(str(filename), loaded) == SETTINGS
+    assert (loaded.bitmap == buffer.bitmap).all()
+    assert (loaded.attributes == buffer.attributes).all()